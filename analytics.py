@@ -0,0 +1,86 @@
+import argparse
+from datetime import date, datetime, timedelta, timezone
+
+from database import attach_archive, create_usertable, for_each_shard, get_conn, rebuild_rollups, shard_for
+
+# Trend queries over the daily rollup tables kept by database.py. Each one
+# reads at most one row per day (per mood), never the raw logs. Rollup days
+# are UTC dates (the timestamps are UTC), so "today" is the UTC date too.
+
+
+def utc_today():
+    return datetime.now(timezone.utc).date()
+
+
+def mood_by_day(username, days=30):
+    since = (utc_today() - timedelta(days=days - 1)).isoformat()
+    return get_conn(username).execute(
+        'SELECT day, mood, entries FROM mood_daily WHERE username = ? AND day >= ? ORDER BY day',
+        (username, since),
+    ).fetchall()
+
+
+def mood_by_week(username, weeks=12):
+    # Weeks start on Monday; labelled by that Monday's date. The window
+    # starts on a Monday too, so the oldest week isn't cut short.
+    today = utc_today()
+    since = (today - timedelta(days=today.weekday(), weeks=weeks - 1)).isoformat()
+    return get_conn(username).execute(
+        "SELECT date(day, 'weekday 0', '-6 days') AS week, mood, SUM(entries) FROM mood_daily "
+        'WHERE username = ? AND day >= ? GROUP BY week, mood ORDER BY week',
+        (username, since),
+    ).fetchall()
+
+
+def phq9_trajectory(username):
+    return get_conn(username).execute(
+        'SELECT day, ROUND(score_sum * 1.0 / entries, 1), last_score, last_level FROM phq9_daily '
+        'WHERE username = ? ORDER BY day',
+        (username,),
+    ).fetchall()
+
+
+def mood_streaks(username, today=None):
+    # Consecutive days with at least one mood entry: (current, longest)
+    days = [row[0] for row in get_conn(username).execute(
+        'SELECT DISTINCT day FROM mood_daily WHERE username = ? ORDER BY day', (username,)
+    )]
+    longest = run = 0
+    previous = None
+    for day in map(date.fromisoformat, days):
+        run = run + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+        longest = max(longest, run)
+        previous = day
+
+    today = today or utc_today()
+    current = run if previous is not None and today - previous <= timedelta(days=1) else 0
+    return current, longest
+
+
+def _backfill_shard(path, username=None):
+    attach_archive(path=path)
+    with get_conn(path=path) as conn:
+        rebuild_rollups(conn, username)
+        moods = conn.execute('SELECT COUNT(*) FROM mood_daily').fetchone()[0]
+        screenings = conn.execute('SELECT COUNT(*) FROM phq9_daily').fetchone()[0]
+    return moods, screenings
+
+
+def backfill(username=None):
+    create_usertable()
+    if username is not None:
+        return _backfill_shard(shard_for(username), username)
+    counts = for_each_shard(_backfill_shard).values()
+    return sum(moods for moods, _ in counts), sum(screenings for _, screenings in counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the mood and PHQ-9 daily rollups from the raw logs.")
+    parser.add_argument("--user", help="only rebuild this user's rollups")
+    args = parser.parse_args()
+    moods, screenings = backfill(args.user)
+    print(f"Rollups rebuilt: {moods} mood_daily rows, {screenings} phq9_daily rows")
+
+
+if __name__ == "__main__":
+    main()
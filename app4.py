@@ -1,83 +1,89 @@
+import time
 import streamlit as st
 from database import (
-    create_usertable,
     add_user,
     login_user,
     save_mood,
     save_phq9,
     save_chat,
+    get_chat_page,
+    search_chats,
+    search_notes,
+    wait_for_user_writes,
 )
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from analytics import mood_by_day, mood_by_week, mood_streaks, phq9_trajectory
+from data_io import export_bytes
+import functools
 import random
-import google.generativeai as genai
-import pandas as pd
-import sqlite3
-import joblib
-
-# ------------------- SENTIMENT ANALYSIS -------------------
-def detect_sentiment(text):
-    analyzer = SentimentIntensityAnalyzer()
-    score = analyzer.polarity_scores(text)
-    compound = score["compound"]
-
-    if compound >= 0.05:
-        return "Positive"
-    elif compound <= -0.05:
-        return "Negative"
-    else:
-        return "Neutral"
-
+import uuid
+import archive
+import metrics
+import resources
+from sentiment import detect_sentiment
+from phq9 import predict_level
+from chat import CANNED_REPLY, ChatContext, ChatStream
+
+rerun_started = time.perf_counter()
+metrics.start_from_env()
+archive.start_from_env()
 
 # ------------------- GEMINI CONFIG -------------------
-genai.configure(api_key=st.secrets["api_keys"]["gemini"])
-gen_model = genai.GenerativeModel("gemini-2.5-flash")
+# The Gemini client is built once per process by resources.py, on first use.
+# All calls go through gemini_client.GeminiClient (deadlines, circuit breaker).
 
 
-# ------------------- MOOD SUGGESTIONS (MODIFIED) -------------------
-fallback_tasks = {
-    "Positive": [
-        "Write down three things you are grateful for right now. 🙏",
-        "Listen to your favorite upbeat song and dance like nobody's watching! 💃",
-        "Plan a fun activity for the weekend to look forward to. 🗓️",
-        "Send a message of appreciation to someone who has helped you. 💌",
-        "Take a short walk and notice five beautiful things around you. 🌳",
-    ],
-    "Neutral": [
-        "Take a moment to simply breathe deeply. 🧘",
-        "Straighten up your desk or living space. 🧹",
-        "Write a simple to-do list for tomorrow. 📝",
-        "Put your phone away for 15 minutes. 📵",
-        "Drink a full glass of water. 💧",
-    ],
-    "Negative": [
-        "Acknowledge how you're feeling without judgment. It's okay. 🫂",
-        "Watch a short video of something that always makes you laugh. 😂",
-        "Call or text a friend you trust. 📞",
-        "Take a warm shower or bath to reset. 🛀",
-        "Listen to music that validates your emotions. 🎶",
-    ],
-}
+# ------------------- SESSION MEMORY -------------------
+# Chat context, history pages and pinned suggestions are kept by the session
+# memory manager (session_store.py), which moves idle sessions to disk when
+# the process holds too much; everything else stays in st.session_state.
+def session_slots():
+    key = st.session_state.setdefault("memory_key", uuid.uuid4().hex)
+    return resources.get("session_memory").slots(key)
 
-def get_suggestions(sentiment):
 
-    prompts = {
-        "Positive": "Generate 5 very short and fun tasks to do for someone who is feeling great.",
-        "Neutral": "Generate 5 simple and calming tasks for someone with a neutral mood.",
-        "Negative": "Generate 5 short and helpful tasks for someone who is feeling low. The tasks should be easy to do.",
-    }
+# ------------------- METRICS CONTEXT -------------------
+# Spans are tagged with the session and the open tab. A fragment rerun runs on
+# a new thread without the full rerun's context, so fragments set it again.
+def set_metrics_context():
+    page = st.session_state.get("page") or "Home"
+    metrics.set_context(session=st.session_state.setdefault("session_tag", uuid.uuid4().hex[:8]), tab=page)
+    return page
+
+
+def profile_requested():
+    # ?profile=1 only counts when the operator allows it (MINDMATE_PROFILE_URL=1)
+    return metrics.profile_url_allowed() and st.query_params.get("profile") == "1"
+
+
+def traced_fragment(fn):
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        set_metrics_context()
+        with metrics.maybe_profile(f"fragment-{fn.__name__}", force=profile_requested()):
+            return fn(*args, **kwargs)
+    return st.fragment(run)
 
+
+# ------------------- MOOD SUGGESTIONS (MODIFIED) -------------------
+def get_suggestions(sentiment):
     st.subheader("Here are some fresh ideas just for you:")
-    try:
-        response = gen_model.generate_content(prompts.get(sentiment, "Generate 5 helpful tasks."))
-        
-        tasks = [t.strip() for t in response.text.split('\n') if t.strip()]
 
+    # Served from the process-wide pool; pinned per submission so reruns
+    # inside the panels below don't reshuffle the list
+    slots = session_slots()
+    if "suggested_tasks" not in slots:
+        tasks, fresh = resources.get("suggestions").get(sentiment)
+        if fresh:
+            slots["suggested_tasks"] = tasks
+    else:
+        tasks, fresh = slots["suggested_tasks"], True
+
+    if fresh:
         for task in tasks:
             st.markdown(f"• {task}")
-
-    except Exception as e:
-        st.error("I'm having trouble connecting to my AI friend. Here are some classic suggestions for now:")
-        for task in random.sample(fallback_tasks.get(sentiment, []), 3):
+    else:
+        st.info("Fresh ideas are on their way. Here are some classic suggestions for now:")
+        for task in tasks:
             st.info(f"• {task}")
 
     if sentiment == "Positive":
@@ -97,114 +103,230 @@ def get_suggestions(sentiment):
         st.subheader("This one is for you")
         st.video("https://youtu.be/_1OfB3DGwpA?si=SwERzTsmIiPdyG4n")
 
-        st.subheader("💡 What would you like to do now?")
-        col1, col2 = st.columns(2)
-
-        with col1:
-            choice = st.radio(
-                "Pick a feel-good action:",
-                (
-                    "🎵 Listen to a Mood-Based Playlist",
-                    "✍️ Write a Private Journal Entry",
-                    "😂 Laugh Break (Meme/Video)",
-                    "📚 Get a Uplift Tip",
-                    "🎯 Mini Task Generator",
-                ),
-            )
+        feel_good_actions()
+
+
+# Runs as a fragment: picking an action reruns only this panel
+@traced_fragment
+def feel_good_actions():
+    st.subheader("💡 What would you like to do now?")
+    col1, col2 = st.columns(2)
+
+    with col1:
+        choice = st.radio(
+            "Pick a feel-good action:",
+            (
+                "🎵 Listen to a Mood-Based Playlist",
+                "✍️ Write a Private Journal Entry",
+                "😂 Laugh Break (Meme/Video)",
+                "📚 Get a Uplift Tip",
+                "🎯 Mini Task Generator",
+            ),
+        )
 
-        with col2:
-            if choice == "🎵 Listen to a Mood-Based Playlist":
-                st.markdown("#### 🎧 Here's something to lift you up:")
-                st.video("https://www.youtube.com/watch?v=jfKfPfyJRdk")
-            elif choice == "✍️ Write a Private Journal Entry":
-                st.markdown("#### ✍️ Let it out — it’s safe here.")
-                journal_text = st.text_area("What’s on your mind?")
-                if st.button("Save Entry"):
-                    st.success("Your thoughts are saved privately 🗒️")
-            elif choice == "😂 Laugh Break (Meme/Video)":
-                st.markdown("#### 😂 Here's something to make you smile:")
-                st.image(
-                    "https://i.programmerhumor.io/2022/07/programmerhumor-io-programming-memes-49973fb83da3327.jpg",
-                    caption="CS students be like 💻",
-                )
-                st.markdown("This will surely help you😂😂")
-                st.video("https://youtu.be/LQlcWclgRlc?si=lxBM7u3WSmCyY9Xq")
-            elif choice == "📚 Get a Uplift Tip":
-                tips = [
-                    "Breathe. You’ve survived 100% of your worst days.",
-                    "Grades don’t define your worth.",
-                    "Take breaks — not breakdowns.",
-                    "It’s okay to rest. Hustle is not everything.",
-                    "Talk to someone. Even a journal helps.",
+    with col2:
+        if choice == "🎵 Listen to a Mood-Based Playlist":
+            st.markdown("#### 🎧 Here's something to lift you up:")
+            st.video("https://www.youtube.com/watch?v=jfKfPfyJRdk")
+        elif choice == "✍️ Write a Private Journal Entry":
+            st.markdown("#### ✍️ Let it out — it’s safe here.")
+            journal_text = st.text_area("What’s on your mind?")
+            if st.button("Save Entry"):
+                st.success("Your thoughts are saved privately 🗒️")
+        elif choice == "😂 Laugh Break (Meme/Video)":
+            st.markdown("#### 😂 Here's something to make you smile:")
+            st.image(
+                "https://i.programmerhumor.io/2022/07/programmerhumor-io-programming-memes-49973fb83da3327.jpg",
+                caption="CS students be like 💻",
+            )
+            st.markdown("This will surely help you😂😂")
+            st.video("https://youtu.be/LQlcWclgRlc?si=lxBM7u3WSmCyY9Xq")
+        elif choice == "📚 Get a Uplift Tip":
+            tips = [
+                "Breathe. You’ve survived 100% of your worst days.",
+                "Grades don’t define your worth.",
+                "Take breaks — not breakdowns.",
+                "It’s okay to rest. Hustle is not everything.",
+                "Talk to someone. Even a journal helps.",
+            ]
+            st.success(random.choice(tips))
+        elif choice == "🎯 Mini Task Generator":
+            task = random.choice(
+                [
+                    "Take a 3-minute stretch break 🧘",
+                    "Drink a full glass of water 💧",
+                    "Send a funny meme to a friend 💬",
+                    "Go touch grass 🌿 (seriously)",
+                    "Write 3 things you’re grateful for 🙏",
                 ]
-                st.success(random.choice(tips))
-            elif choice == "🎯 Mini Task Generator":
-                task = random.choice(
-                    [
-                        "Take a 3-minute stretch break 🧘",
-                        "Drink a full glass of water 💧",
-                        "Send a funny meme to a friend 💬",
-                        "Go touch grass 🌿 (seriously)",
-                        "Write 3 things you’re grateful for 🙏",
-                    ]
-                )
-                st.info(task)
+            )
+            st.info(task)
 
 
 # ------------------- GEMINI CHAT -------------------
+@traced_fragment
 def gemini_chat_ui():
     st.subheader("Feel free to chat with your AI friend!")
     st.markdown("##### _Type something to talk..._")
 
-    if "chat" not in st.session_state:
-        st.session_state.chat = gen_model.start_chat(history=[])
+    # Rebuilt from the user's recent chat_history, so context survives logout
+    slots = session_slots()
+    if "chat_context" not in slots:
+        slots["chat_context"] = ChatContext.rehydrate(resources.get("gemini"), st.session_state["username"])
+    context = slots["chat_context"]
 
     user_msg = st.text_input("You: ", key="chat_input")
 
     if st.button("Send"):
         if user_msg.strip() != "":
-            try:
-                response = st.session_state.chat.send_message(user_msg)
-                st.markdown("**AI says:**")
-                st.info(response.text)
-
-                if response:
-                    save_chat(st.session_state["username"], user_msg, response.text)
-
-            except Exception as e:
-                st.error(f"Error: {e}")
+            st.markdown("**AI says:**")
+            # Chunks are rendered as they arrive; only a complete reply is saved
+            stream = ChatStream(context.chat, user_msg)
+            st.write_stream(stream)
+
+            if stream.completed:
+                context.record(user_msg, stream.text)
+                save_chat(st.session_state["username"], user_msg, stream.text)
+                reset_chat_history()
+            elif not stream.text:
+                # Nothing came through (timeout, or Gemini is marked unhealthy)
+                st.info(CANNED_REPLY)
+            else:
+                st.error(f"Error: {stream.error}")
         else:
             st.warning("Please type a message.")
 
 
 # ------------------- CHAT HISTORY -------------------
+def reset_chat_history():
+    slots = session_slots()
+    slots.pop("history_rows", None)
+    slots.pop("history_cursor", None)
+
+
+def load_chat_history_page():
+    slots = session_slots()
+    rows, cursor = get_chat_page(st.session_state["username"], slots.get("history_cursor"))
+    slots["history_rows"] = slots.get("history_rows", []) + rows
+    slots["history_cursor"] = cursor
+
+
+def reset_search_page():
+    st.session_state["search_page"] = 0
+
+
+def move_search_page(step):
+    st.session_state["search_page"] += step
+
+
+def history_search(query):
+    scope = st.radio("Search in", ["Chats", "Mood notes"], horizontal=True, key="search_scope",
+                     on_change=reset_search_page)
+    page = st.session_state.setdefault("search_page", 0)
+    search = search_chats if scope == "Chats" else search_notes
+    results, has_more = search(st.session_state["username"], query, page)
+
+    if not results:
+        st.info("No matches found.")
+    for text, detail, timestamp in results:
+        with st.expander(f" {timestamp}", expanded=True):
+            if scope == "Chats":
+                st.markdown(f"**You:** {text}")
+                st.markdown(f"**AI:** {detail}")
+            else:
+                st.markdown(f"**Mood:** {detail}")
+                st.markdown(text)
+
+    col1, col2 = st.columns(2)
+    if page > 0:
+        col1.button("Previous results", on_click=move_search_page, args=(-1,))
+    if has_more:
+        col2.button("More results", on_click=move_search_page, args=(1,))
+
+
+@traced_fragment
 def view_chat_history():
     st.subheader(" Your Chat History")
     if "username" in st.session_state:
-        username = st.session_state["username"]
+        query = st.text_input("🔍 Search your chats and mood notes", key="history_query", on_change=reset_search_page)
+        if query.strip():
+            history_search(query)
+            return
 
-        conn = sqlite3.connect("users.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT message,response,timestamp FROM chat_history WHERE username = ? ORDER BY timestamp DESC",
-            (username,),
-        )
-        records = cursor.fetchall()
-        conn.close()
+        # Pages are kept with the session, so reruns don't query again
+        slots = session_slots()
+        if "history_rows" not in slots:
+            load_chat_history_page()
+        records = slots["history_rows"]
 
         if records:
             for i, (message, response, timestamp) in enumerate(records, 1):
                 with st.expander(f" {timestamp}"):
                     st.markdown(f"**You:** {message}")
                     st.markdown(f"**AI:** {response}")
+
+            if slots["history_cursor"] is not None:
+                st.button("Load older chats", on_click=load_chat_history_page)
         else:
             st.info("No chat history found.")
     else:
         st.warning("Please log in or identify yourself first.")
 
 
+# ------------------- TRENDS -------------------
+@traced_fragment
+def trends_page():
+    import pandas as pd
+
+    st.subheader("📈 Your Trends")
+    username = st.session_state["username"]
+    wait_for_user_writes(username)
+
+    current, longest = mood_streaks(username)
+    col1, col2 = st.columns(2)
+    col1.metric("Current check-in streak", f"{current} days")
+    col2.metric("Longest streak", f"{longest} days")
+
+    st.markdown("#### Mood mix")
+    period = st.radio("Show by", ["Day", "Week"], horizontal=True, key="trends_period")
+    rows = mood_by_day(username) if period == "Day" else mood_by_week(username)
+    if rows:
+        mix = pd.DataFrame(rows, columns=[period, "Mood", "Entries"])
+        st.bar_chart(mix.pivot_table(index=period, columns="Mood", values="Entries", fill_value=0))
+    else:
+        st.info("No mood check-ins yet. Tell me about your day on the Home page. 💬")
+
+    st.markdown("#### PHQ-9 score over time")
+    rows = phq9_trajectory(username)
+    if rows:
+        scores = pd.DataFrame(rows, columns=["Day", "Average score", "Last score", "Level"]).set_index("Day")
+        st.line_chart(scores[["Average score"]])
+        st.caption(f"Latest screening: {rows[-1][2]} ({rows[-1][3]})")
+    else:
+        st.info("No screenings yet. Try the Screening page when you're ready.")
+
+
+# ------------------- MY DATA -------------------
+@traced_fragment
+def my_data_page():
+    st.subheader("📦 Your Data")
+    st.write("Download your mood check-ins, screenings and chats.")
+    username = st.session_state["username"]
+    fmt = st.radio("Format", ["JSON lines", "CSV"], horizontal=True, key="export_format")
+    compress = st.checkbox("Compress (gzip)", value=True, key="export_gzip")
+
+    ext = "jsonl" if fmt == "JSON lines" else "csv"
+    # The file is only built when the button is clicked, on its own thread
+    st.download_button(
+        "⬇️ Download my data",
+        data=lambda: export_bytes(username, ext, compress),
+        file_name=f"mindmate-{username}.{ext}" + (".gz" if compress else ""),
+        mime="application/gzip" if compress else ("text/csv" if ext == "csv" else "application/jsonl"),
+    )
+
+
 # ------------------- PHQ-9 MODEL -------------------
-model = joblib.load("phq9_model.pkl")
+# Predictions come from the lookup table built by build_phq9_table.py
 
 
 def show_suggestions(level):
@@ -244,6 +366,7 @@ def show_suggestions(level):
         st.markdown("- You are not alone — help is available. 💌")
 
 
+@traced_fragment
 def phq9_form():
     st.subheader("PHQ-9 Depression Screening")
 
@@ -273,116 +396,102 @@ def phq9_form():
 
     if st.button("Submit Screening"):
         total_score = sum(answers)
-        prediction = model.predict([answers])
+        prediction = predict_level(answers)
 
         st.success(f"Total PHQ-9 Score: {total_score}")
         st.info(f"Predicted Depression Level: {prediction}")
 
         show_suggestions(prediction)
-        save_phq9(st.session_state["username"], total_score, prediction[0])
+        save_phq9(st.session_state["username"], total_score, prediction)
 
         st.subheader(
             ".....Please go to 'AI FRIEND' section in sidebar you will love it......."
         )
 
 
+# ------------------- HOME -------------------
+def home_page():
+    if "submitted" not in st.session_state:
+        st.session_state["submitted"] = False
+
+    if not st.session_state["submitted"]:
+        st.markdown("### Tell me about your day. I'm here to listen... 💬")
+        user_input = st.text_area("How was your day today?", height=150)
+
+        if st.button("Submit Mood"):
+            if user_input:
+                sentiment = detect_sentiment(user_input)
+                st.session_state["sentiment"] = sentiment
+                st.session_state["submitted"] = True
+                session_slots().pop("suggested_tasks", None)
+                save_mood(st.session_state["username"], sentiment, user_input)
+                st.rerun()
+            else:
+                st.warning("Please share something about your day.")
+    else:
+        sentiment = st.session_state.get("sentiment", "Neutral")
+        st.success(f"Detected Mood: {sentiment} ")
+        get_suggestions(sentiment)
+
+        if st.button("🔄 Start Over"):
+            st.session_state["submitted"] = False
+            st.rerun()
+
+
+PAGES = {
+    "Home": home_page,
+    "AI Friend": gemini_chat_ui,
+    "Screening": phq9_form,
+    "Chat History": view_chat_history,
+    "Trends": trends_page,
+    "My Data": my_data_page,
+}
+
+
 # ------------------- MAIN APP -------------------
-create_usertable()
+resources.get("schema")
 st.markdown(
-    """
-    <style>
-        @import url('https://fonts.googleapis.com/css2?family=Pacifico&family=Montserrat:wght@900&display=swap');
-
-        /* ----------- GLOBAL DARK THEME ----------- */
-        body, .main, .stApp {
-            background: linear-gradient(135deg, #0F0C29, #302B63, #24243E) !important;
-            color: #EAEAEA !important;
-        }
-
-        /* Make all Streamlit containers dark */
-        .block-container {
-            background: transparent !important;
-        }
-
-        /* ----------- TITLE ----------- */
-        .main-title {
-            font-family: 'Pacifico', cursive;
-            font-size: 72px;
-            font-weight: 900;
-            text-align: center;
-            letter-spacing: 2px;
-            background: -webkit-linear-gradient(45deg, #A56CFF, #FF8AD4);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            margin-top: 20px;
-            margin-bottom: 40px;
-        }
-
-        /* ----------- INPUT FIELDS ----------- */
-        .stTextInput>div>div>input {
-            background-color: #1F1B3A !important;
-            color: white !important;
-            border-radius: 10px !important;
-            border: 1px solid #8A2BE2 !important;
-        }
-
-        .stTextInput>div>div>input:focus {
-            border: 1.5px solid #FF69B4 !important;
-            background-color: #2A224A !important;
-        }
-
-        /* ----------- BUTTONS ----------- */
-        .stButton>button {
-            border-radius: 20px;
-            border: 2px solid #FF69B4;
-            color: white;
-            background: linear-gradient(135deg, #5A0EA1, #8A2BE2);
-            transition: all 0.3s ease-in-out;
-            padding: 10px 20px;
-            font-weight: 600;
-        }
-
-        .stButton>button:hover {
-            background: linear-gradient(135deg, #FF69B4, #A020F0);
-            color: white;
-            border: 2px solid #FFFFFF;
-            transform: translateY(-2px);
-            box-shadow: 0px 4px 15px rgba(255, 105, 180, 0.25);
-        }
-
-        /* ----------- TABS ----------- */
-        .stTabs [data-baseweb="tab-list"] {
-            gap: 10px;
-        }
-
-        .stTabs [data-baseweb="tab"] {
-            border-radius: 20px 20px 0 0 !important;
-            background-color: #5A0EA1;
-            color: white;
-            padding: 10px 20px;
-            transition: all 0.3s ease-in-out;
-            font-weight: 600;
-        }
-
-        .stTabs [aria-selected="true"] {
-            background-color: #FF69B4 !important;
-            color: #2A004D !important;
-            box-shadow: 0px -3px 10px rgba(255, 105, 180, 0.4);
-        }
-
-        /* ----------- LABELS / HEADINGS ----------- */
-        h1, h2, h3, h4, h5, label, p {
-            color: #EAEAEA !important;
-        }
-    </style>
-
-    <div class="main-title">MIND MATE</div>
-    """,
+    resources.get("css") + '\n<div class="main-title">MIND MATE</div>',
     unsafe_allow_html=True,
 )
 
 # ------------------- LOGIN/SIGNUP UI -------------------
+# The signed session token lives in a cookie, so a reconnecting browser or a
+# new tab logs straight back in without the token ever appearing in a URL.
+SESSION_COOKIE = "mindmate_session"
+
+
+def start_session(username, token):
+    st.session_state["logged_in"] = True
+    st.session_state["username"] = username
+    st.session_state["submitted"] = False
+    st.session_state["session_token"] = token
+
+
+def write_session_cookie(token, max_age):
+    # Streamlit can't set cookies itself, so a script in the page does. The
+    # token is our own base64url string, never user input.
+    secure = "; Secure" if (st.context.url or "").startswith("https") else ""
+    st.html(
+        f"<script>document.cookie = '{SESSION_COOKIE}={token}; Max-Age={max_age}; "
+        f"Path=/; SameSite=Strict{secure}';</script>",
+        unsafe_allow_javascript=True,
+    )
+
+
+# Tokens from older links are never honoured; drop them from the address bar
+if "session" in st.query_params:
+    st.query_params.pop("session")
+
+if not st.session_state.get("logged_in") and not st.session_state.get("logged_out"):
+    cookie_token = st.context.cookies.get(SESSION_COOKIE)
+    token_user = resources.get("sessions").check(cookie_token)
+    if token_user:
+        start_session(token_user, cookie_token)
+
 if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
+    if st.session_state.get("logged_out"):
+        write_session_cookie("", 0)
     login_tab, signup_tab = st.tabs(["🔐 Login", "➕ Sign Up"])
 
     with login_tab:
@@ -393,9 +502,8 @@ if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
             result = login_user(username, password)
             if result:
                 st.success(f"Welcome back, {username}!")
-                st.session_state["logged_in"] = True
-                st.session_state["username"] = username
-                st.session_state["submitted"] = False
+                start_session(username, resources.get("sessions").issue(username))
+                st.session_state["cookie_pending"] = True
                 st.rerun()
             else:
                 st.error("Invalid credentials")
@@ -405,59 +513,41 @@ if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
         new_user = st.text_input("New Username")
         new_password = st.text_input("New Password", type="password")
         if st.button("Sign Up"):
-            add_user(new_user, new_password)
-            st.success("Account created! 🎉 Now you can Login.")
+            if not new_user or not new_password:
+                st.warning("Please choose a username and a password.")
+            elif add_user(new_user, new_password):
+                st.success("Account created! 🎉 Now you can Login.")
+            else:
+                st.error("That username is already taken.")
 
 # ------------------- LOGGED-IN PAGES -------------------
 else:
-    # A single row for tabs and a logout button
+    # A single row for the greeting and a logout button
     tab_list, logout_col = st.columns([5,1])
     with tab_list:
         st.subheader(f"Welcome, {st.session_state['username']}!")
     with logout_col:
         if st.button("Logout"):
+            resources.get("sessions").revoke(st.session_state.get("session_token"))
+            if "memory_key" in st.session_state:
+                resources.get("session_memory").drop(st.session_state["memory_key"])
             st.session_state.clear()
+            # The browser still sends the old cookie until the next render clears it
+            st.session_state["logged_out"] = True
             st.success("You have been logged out. 👋")
             st.rerun()
+    if st.session_state.pop("cookie_pending", False):
+        write_session_cookie(st.session_state["session_token"], resources.get("sessions").ttl)
 
-    # Tabs for main navigation
-    tab1, tab2, tab3, tab4 = st.tabs(["Home", "AI Friend", "Screening", "Chat History"])
+    # Only the selected page runs; the others do no work on this rerun
+    page = st.segmented_control(
+        "Navigation", list(PAGES), key="page", default="Home", label_visibility="collapsed"
+    )
+    page = set_metrics_context()
 
-    # ------------------- TAB 1: HOME -------------------
-    with tab1:
-        if "submitted" not in st.session_state:
-            st.session_state["submitted"] = False
-
-        if not st.session_state["submitted"]:
-            st.markdown("### Tell me about your day. I'm here to listen... 💬")
-            user_input = st.text_area("How was your day today?", height=150)
-
-            if st.button("Submit Mood"):
-                if user_input:
-                    sentiment = detect_sentiment(user_input)
-                    st.session_state["sentiment"] = sentiment
-                    st.session_state["submitted"] = True
-                    save_mood(st.session_state["username"], sentiment, user_input)
-                    st.rerun()
-                else:
-                    st.warning("Please share something about your day.")
-        else:
-            sentiment = st.session_state.get("sentiment", "Neutral")
-            st.success(f"Detected Mood: {sentiment} ")
-            get_suggestions(sentiment)
+    # MINDMATE_PROFILE_RATE (or an allowed ?profile=1) profiles this render
+    with metrics.maybe_profile(f"rerun-{page}", force=profile_requested()):
+        PAGES[page]()
+    resources.get("session_memory").enforce()
 
-            if st.button("🔄 Start Over"):
-                st.session_state["submitted"] = False
-                st.rerun()
-    
-    # ------------------- TAB 2: GEMINI CHAT -------------------
-    with tab2:
-        gemini_chat_ui()
-
-    # ------------------- TAB 3: DEPRESSION SCREENING -------------------
-    with tab3:
-        phq9_form()
-    
-    # ------------------- TAB 4: CHAT HISTORY -------------------
-    with tab4:
-        view_chat_history()
\ No newline at end of file
+resources.record_rerun(time.perf_counter() - rerun_started)
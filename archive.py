@@ -0,0 +1,264 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from database import archive_path, attach_archive, for_each_shard, get_conn, pack
+from metrics import incr, timed
+
+logger = logging.getLogger("mindmate")
+
+# Hot/cold tiering for users.db. Rows of chat_history and mood_logs older
+# than ARCHIVE_AFTER_DAYS move into the archive database (see database.py,
+# ARCHIVE TIER); get_chat_page and the exports read both tiers, so users
+# still see everything. Archived rows move from the main full-text index to
+# the archive's own, and search reads both. With sharded storage every shard
+# has its own archive and each command runs on all shards in parallel.
+#
+#   python archive.py archive --days 180    move old rows to the archive
+#   python archive.py maintain              incremental vacuum + ANALYZE
+#   python archive.py vacuum                one-off full VACUUM, enabling incremental vacuum
+#   python archive.py report                sizes and fragmentation
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_BATCH_SIZE = 2000
+# Pages released per maintenance run, so a run never holds the write lock long
+VACUUM_STEP_PAGES = 2000
+ANALYSIS_LIMIT = 1000
+
+MOVES = {
+    'chat_history': (
+        'SELECT rowid, username, timestamp, message, response FROM main.chat_history '
+        'WHERE rowid > ? AND timestamp < ? ORDER BY rowid LIMIT ?',
+        'INSERT OR IGNORE INTO archive.chat_history(id, username, timestamp, message, response) VALUES (?, ?, ?, ?, ?)',
+    ),
+    'mood_logs': (
+        'SELECT rowid, username, timestamp, mood, note FROM main.mood_logs '
+        'WHERE rowid > ? AND timestamp < ? ORDER BY rowid LIMIT ?',
+        'INSERT OR IGNORE INTO archive.mood_logs(id, username, timestamp, mood, note) VALUES (?, ?, ?, ?, ?)',
+    ),
+}
+
+
+# ------------------- TIERING -------------------
+def _archive_shard(path, cutoff, batch_size):
+    attach_archive(path=path, create=True)
+    conn = get_conn(path=path)
+    moved = {}
+    for table, (select, insert) in MOVES.items():
+        last, count = 0, 0
+        while True:
+            rows = conn.execute(select, (last, cutoff, batch_size)).fetchall()
+            if not rows:
+                break
+            last = rows[-1][0]
+            # Two transactions, archive first. In WAL mode a transaction over
+            # attached databases is only atomic per file, so a crash between
+            # them leaves a row in both tiers (get_chat_page, the rollups and
+            # the exports count it once, see database.ARCHIVE_ONLY, and INSERT
+            # OR IGNORE makes the retry a no-op), never in neither.
+            with conn:
+                conn.executemany(insert, [(rowid, user, ts, pack(a), pack(b)) for rowid, user, ts, a, b in rows])
+            with conn:
+                conn.executemany(f'DELETE FROM main.{table} WHERE rowid = ?', [(row[0],) for row in rows])
+            count += len(rows)
+        moved[table] = count
+        incr(f'archive.moved.{table}', count)
+    return moved
+
+
+@timed('archive.move')
+def archive_older_than(days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    # Returns {table: rows moved}, summed over the shards
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    moved = dict.fromkeys(MOVES, 0)
+    for counts in for_each_shard(lambda path: _archive_shard(path, cutoff, batch_size)).values():
+        for table, count in counts.items():
+            moved[table] += count
+    return moved
+
+
+# ------------------- MAINTENANCE -------------------
+def _schemas(conn, path):
+    # [(schema, file)] for the shard's main database and its archive
+    return [(row[1], path if row[1] == 'main' else archive_path(path))
+            for row in conn.execute('PRAGMA database_list') if row[1] in ('main', 'archive')]
+
+
+def _maintain_shard(path, vacuum_pages):
+    attach_archive(path=path)
+    conn = get_conn(path=path)
+    released = {}
+    for schema, file in _schemas(conn, path):
+        free = conn.execute(f'PRAGMA {schema}.freelist_count').fetchone()[0]
+        mode = conn.execute(f'PRAGMA {schema}.auto_vacuum').fetchone()[0]
+        released[file] = 0
+        if free and mode == 2:
+            # execute() would step the pragma once and free a single page
+            conn.executescript(f'PRAGMA {schema}.incremental_vacuum({vacuum_pages})')
+            released[file] = free - conn.execute(f'PRAGMA {schema}.freelist_count').fetchone()[0]
+
+        # PRAGMA optimize only refreshes statistics that already exist
+        analyzed = conn.execute(
+            f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'sqlite_stat1'"
+        ).fetchone()
+        conn.execute(f'PRAGMA analysis_limit={ANALYSIS_LIMIT}')
+        conn.execute(f'ANALYZE {schema}' if analyzed is None else f'PRAGMA {schema}.optimize')
+        conn.commit()
+    return released
+
+
+@timed('archive.maintain')
+def run_maintenance(vacuum_pages=VACUUM_STEP_PAGES):
+    # Gives back up to vacuum_pages free pages per file and refreshes the
+    # planner statistics; returns {file: pages released}
+    released = {}
+    for shard in for_each_shard(lambda path: _maintain_shard(path, vacuum_pages)).values():
+        released.update(shard)
+    incr('archive.maintenance_runs')
+    return released
+
+
+def _vacuum_shard(path):
+    attach_archive(path=path)
+    conn = get_conn(path=path)
+    for schema, _ in _schemas(conn, path):
+        if conn.execute(f'PRAGMA {schema}.auto_vacuum').fetchone()[0] != 2:
+            conn.execute(f'PRAGMA {schema}.auto_vacuum=INCREMENTAL')
+        conn.execute(f'VACUUM {schema}')
+    with conn:
+        conn.execute("INSERT INTO chat_fts(chat_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO mood_fts(mood_fts) VALUES ('rebuild')")
+
+
+def enable_incremental_vacuum():
+    # auto_vacuum can only change on an existing file through a full VACUUM,
+    # which rewrites it and may renumber rowids; the FTS indexes are keyed by
+    # rowid, so they are rebuilt afterwards. Run while the app is stopped.
+    for_each_shard(_vacuum_shard)
+
+
+_maintenance_thread = None
+_maintenance_lock = threading.Lock()
+
+
+def start_maintenance(interval, archive_after_days=None):
+    # Background maintenance for long-running app processes, once per process
+    global _maintenance_thread
+    with _maintenance_lock:
+        if _maintenance_thread is None:
+            def loop():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        if archive_after_days is not None:
+                            moved = archive_older_than(archive_after_days)
+                            if any(moved.values()):
+                                logger.info("Archived %s", moved)
+                        run_maintenance()
+                    except Exception:
+                        logger.exception("Database maintenance failed")
+
+            _maintenance_thread = threading.Thread(target=loop, name="mindmate-maintenance", daemon=True)
+            _maintenance_thread.start()
+
+
+def start_from_env():
+    # MINDMATE_MAINTENANCE_INTERVAL: vacuum/ANALYZE every N seconds
+    # MINDMATE_ARCHIVE_AFTER_DAYS: with it, also archive rows older than N days
+    interval = os.environ.get("MINDMATE_MAINTENANCE_INTERVAL")
+    if interval:
+        days = os.environ.get("MINDMATE_ARCHIVE_AFTER_DAYS")
+        start_maintenance(float(interval), float(days) if days else None)
+
+
+# ------------------- REPORT -------------------
+def _file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _report_shard(path, tables):
+    attach_archive(path=path)
+    conn = get_conn(path=path)
+    report = {}
+    for schema, file in _schemas(conn, path):
+        page_size = conn.execute(f'PRAGMA {schema}.page_size').fetchone()[0]
+        pages = conn.execute(f'PRAGMA {schema}.page_count').fetchone()[0]
+        free = conn.execute(f'PRAGMA {schema}.freelist_count').fetchone()[0]
+        entry = {
+            'schema': schema,
+            'file_bytes': _file_size(file),
+            'wal_bytes': _file_size(file + '-wal'),
+            'page_size': page_size,
+            'pages': pages,
+            'free_pages': free,
+            'free_percent': 100 * free / pages if pages else 0.0,
+            'auto_vacuum': ('none', 'full', 'incremental')[conn.execute(f'PRAGMA {schema}.auto_vacuum').fetchone()[0]],
+        }
+        if tables:
+            # dbstat reads every page: bytes used per table, how full its
+            # pages are, and how many leaf pages are out of order on disk
+            # (the sqlite3_analyzer "fragmentation" figure)
+            entry['tables'] = {}
+            for name, size, unused, count in conn.execute(
+                'SELECT name, SUM(pgsize), SUM(unused), COUNT(*) FROM dbstat(?) GROUP BY name ORDER BY 2 DESC', (schema,)
+            ):
+                entry['tables'][name] = {'bytes': size, 'fill_percent': 100 * (size - unused) / size, 'pages': count}
+            previous = {}
+            jumps = {}
+            for name, pageno in conn.execute(
+                "SELECT name, pageno FROM dbstat(?) WHERE pagetype = 'leaf' ORDER BY name, path", (schema,)
+            ):
+                if name in previous and pageno != previous[name] + 1:
+                    jumps[name] = jumps.get(name, 0) + 1
+                previous[name] = pageno
+            for name, row in entry['tables'].items():
+                row['fragmentation_percent'] = 100 * jumps.get(name, 0) / row['pages']
+        report[file] = entry
+    return report
+
+
+def storage_report(tables=True):
+    # {file: entry} for every shard and archive file
+    report = {}
+    for shard in for_each_shard(lambda path: _report_shard(path, tables)).values():
+        report.update(shard)
+    return report
+
+
+def print_report(report):
+    for file, entry in report.items():
+        print(f"{entry['schema']}: {file}  {entry['file_bytes'] / 1e6:.1f} MB (+{entry['wal_bytes'] / 1e6:.1f} MB WAL), "
+              f"{entry['pages']} pages of {entry['page_size']} B, {entry['free_pages']} free "
+              f"({entry['free_percent']:.1f}%), auto_vacuum={entry['auto_vacuum']}")
+        if 'tables' in entry:
+            print(f"  {'table':32} {'MB':>8} {'fill %':>7} {'frag %':>7}")
+            for name, row in entry['tables'].items():
+                print(f"  {name:32} {row['bytes'] / 1e6:8.2f} {row['fill_percent']:7.1f} {row['fragmentation_percent']:7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old rows and maintain the MindMate databases.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    move = sub.add_parser('archive', help='move rows older than --days to the archive database')
+    move.add_argument('--days', type=float, default=ARCHIVE_AFTER_DAYS)
+    sub.add_parser('maintain', help='incremental vacuum and ANALYZE')
+    sub.add_parser('vacuum', help='full VACUUM, switching the files to incremental auto-vacuum')
+    show = sub.add_parser('report', help='sizes and fragmentation')
+    show.add_argument('--no-tables', action='store_true', help='skip the per-table scan')
+    args = parser.parse_args()
+
+    if args.command == 'archive':
+        print(f"Archived {archive_older_than(args.days)}")
+    elif args.command == 'maintain':
+        print(f"Pages released: {run_maintenance()}")
+    elif args.command == 'vacuum':
+        enable_incremental_vacuum()
+        print("Vacuumed; incremental auto-vacuum enabled")
+    else:
+        print_report(storage_report(tables=not args.no_tables))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import incr
+
+logger = logging.getLogger("mindmate")
+
+# ------------------- PASSWORDS -------------------
+# Stored as a per-user random salt plus a PBKDF2-SHA256 key. The iteration
+# count is stored with each user, so raising it upgrades keys as users log in.
+# Passwords carried over from the legacy plaintext table get a cheap
+# MIGRATION_ITERATIONS key (see database._hash_legacy_passwords), raised to
+# the full count on that user's next login.
+PASSWORD_ITERATIONS = 600_000
+MIGRATION_ITERATIONS = 1_000
+SALT_BYTES = 16
+
+
+def hash_password(password, salt=None, iterations=PASSWORD_ITERATIONS):
+    salt = salt if salt is not None else os.urandom(SALT_BYTES)
+    key = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return salt, key, iterations
+
+
+def verify_password(password, salt, key, iterations):
+    if iterations == 0:
+        # A legacy password not hashed yet; refused rather than compared in plaintext
+        hash_password(password, salt)
+        return False
+    return hmac.compare_digest(hash_password(password, salt, iterations)[1], key)
+
+
+# ------------------- SESSIONS -------------------
+# After login the app hands out a token "<payload>.<signature>", where the
+# payload carries the username and expiry and the signature is an HMAC under
+# the server secret. The app keeps it in a SameSite=Strict cookie (never in
+# the URL), so a reconnect or a new tab logs straight back in. Valid tokens
+# are kept in an LRU: a hit costs a dict lookup, a miss (after eviction or a
+# restart) re-checks the signature and that the user still exists.
+SESSION_TTL = 12 * 3600
+SESSION_CACHE_SIZE = 10000
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def session_secret():
+    secret = os.environ.get('MINDMATE_SESSION_SECRET')
+    if secret:
+        return secret.encode('utf-8')
+    logger.warning("MINDMATE_SESSION_SECRET is not set; sessions won't survive a restart")
+    return secrets.token_bytes(32)
+
+
+class SessionStore:
+    def __init__(self, secret, user_exists, ttl=SESSION_TTL, capacity=SESSION_CACHE_SIZE):
+        self.secret = secret
+        self.user_exists = user_exists
+        self.ttl = ttl
+        self.capacity = capacity
+        self._cache = OrderedDict()   # token -> (username, expires)
+        self._revoked = {}            # token -> expires, until it would have expired anyway
+        self._lock = threading.Lock()
+
+    def _sign(self, payload):
+        return _b64(hmac.new(self.secret, payload.encode('ascii'), hashlib.sha256).digest())
+
+    def issue(self, username):
+        expires = int(time.time()) + self.ttl
+        payload = _b64(f'{expires}:{secrets.token_hex(8)}:{username}'.encode('utf-8'))
+        token = f'{payload}.{self._sign(payload)}'
+        self._remember(token, username, expires)
+        incr('auth.sessions_issued')
+        return token
+
+    def _remember(self, token, username, expires):
+        with self._lock:
+            self._cache[token] = (username, expires)
+            self._cache.move_to_end(token)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+
+    def check(self, token):
+        # Returns the username for a valid token, else None
+        if not token or not token.isascii():
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(token)
+            if entry is not None:
+                if entry[1] > now:
+                    self._cache.move_to_end(token)
+                    incr('auth.session_cache.hits')
+                    return entry[0]
+                del self._cache[token]
+                return None
+            if token in self._revoked:
+                return None
+        incr('auth.session_cache.misses')
+
+        payload, _, signature = token.partition('.')
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        try:
+            expires, _, username = _unb64(payload).decode('utf-8').split(':', 2)
+            expires = int(expires)
+        except ValueError:
+            return None
+        if expires <= now or not self.user_exists(username):
+            return None
+        self._remember(token, username, expires)
+        return username
+
+    def revoke(self, token):
+        # Logout. Only this process forgets the token; other worker
+        # processes keep honouring it until it expires.
+        if not token:
+            return
+        now = time.time()
+        with self._lock:
+            entry = self._cache.pop(token, None)
+            self._revoked = {t: expires for t, expires in self._revoked.items() if expires > now}
+            self._revoked[token] = entry[1] if entry else now + self.ttl
@@ -0,0 +1,105 @@
+"""Hot/cold tiering: database size before and after archiving old rows, and
+chat history paging through the hot rows and on into the archive.
+
+Run from the repo root:  python -m benchmarks.archive --users 50 --chats 4000 --days 90
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("MINDMATE_DB", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import archive  # noqa: E402
+import database  # noqa: E402
+import metrics  # noqa: E402
+
+WORDS = (
+    "try to notice your breathing and give yourself a few quiet minutes before bed "
+    "it is normal to feel stressed before exams so plan small steps and take breaks "
+    "talking to a friend or writing down what worries you can make it feel lighter"
+).split()
+
+
+def reply(rng):
+    # Gemini replies run to a few paragraphs
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(60, 160)))
+
+
+def populate(users, chats, moods, rng):
+    now = datetime.now(timezone.utc)
+    span = timedelta(days=730)
+    for n in range(users):
+        username = f"user{n}"
+        chat_rows = [(username, f"message {i} " + " ".join(rng.choice(WORDS) for _ in range(12)), reply(rng),
+                      (now - span * rng.random()).strftime("%Y-%m-%d %H:%M:%S")) for i in range(chats)]
+        mood_rows = [(username, rng.choice(["Positive", "Neutral", "Negative"]), " ".join(rng.choice(WORDS) for _ in range(25)),
+                      (now - span * rng.random()).strftime("%Y-%m-%d %H:%M:%S")) for _ in range(moods)]
+        with database.get_conn() as conn:
+            database._write_rows(conn, "chat_history", chat_rows)
+            database._write_rows(conn, "mood_logs", mood_rows)
+
+
+def page_through(username, pages):
+    # Latency of each of the first `pages` history pages
+    times, cursor = [], None
+    for _ in range(pages):
+        started = time.perf_counter()
+        _, cursor = database.get_chat_page(username, cursor)
+        times.append(time.perf_counter() - started)
+        if cursor is None:
+            break
+    return times
+
+
+def sizes(label):
+    report = archive.storage_report(tables=False)
+    parts = [f"{entry['schema']} {entry['file_bytes'] / 1e6:.1f} MB ({entry['free_percent']:.1f}% free)" for entry in report.values()]
+    print(f"{label:28} " + ", ".join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--chats", type=int, default=4000, help="chats per user, spread over two years")
+    parser.add_argument("--moods", type=int, default=1000, help="mood entries per user")
+    parser.add_argument("--days", type=float, default=90, help="archive rows older than this")
+    parser.add_argument("--pages", type=int, default=200, help="history pages to read for user0")
+    args = parser.parse_args()
+
+    database.create_usertable()
+    populate(args.users, args.chats, args.moods, random.Random(1))
+    database.get_conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    sizes("before")
+    before = page_through("user0", args.pages)
+
+    started = time.perf_counter()
+    moved = archive.archive_older_than(args.days)
+    elapsed = time.perf_counter() - started
+    total = sum(moved.values())
+    print(f"Archived {moved} in {elapsed:.1f}s ({total / elapsed:.0f} rows/s)")
+    database.get_conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    sizes("after archiving")
+
+    started = time.perf_counter()
+    released = archive.run_maintenance(vacuum_pages=10 ** 9)
+    print(f"Maintenance released {released} pages in {time.perf_counter() - started:.1f}s")
+    database.get_conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    sizes("after incremental vacuum")
+
+    after = page_through("user0", args.pages)
+    hot_pages = database.get_conn().execute(
+        "SELECT COUNT(*) FROM main.chat_history WHERE username = 'user0'"
+    ).fetchone()[0] // database.CHAT_PAGE_SIZE
+    print()
+    print(f"History paging for user0 ({hot_pages} hot pages, {len(after)} pages read)")
+    print(f"  {'':22} {'p50 ms':>8} {'p95 ms':>8}")
+    for label, values in (("one tier", before), ("hot pages", after[:hot_pages]), ("archive pages", after[hot_pages + 1:])):
+        if values:
+            print(f"  {label:22} {metrics.percentile(values, 50) * 1000:8.3f} {metrics.percentile(values, 95) * 1000:8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Login and session-check cost at a large user count: the old unindexed
+plaintext lookup against the indexed lookup, the full login (lookup plus
+PBKDF2), and session tokens served from the LRU or re-validated.
+
+Run from the repo root:  python -m benchmarks.auth --users 1000000
+"""
+import argparse
+import os
+import secrets
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("MINDMATE_DB", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import auth  # noqa: E402
+import database  # noqa: E402
+import metrics  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+
+
+def populate(users, real_keys):
+    # Hashing a million passwords at full cost would take days, so most
+    # users get random bytes as their key; the first real_keys users can
+    # actually log in
+    conn = database.get_conn()
+    conn.execute("CREATE TABLE legacy_users(username TEXT, password TEXT)")
+    batch = 50000
+    for start in range(0, users, batch):
+        names = [f"user{n}" for n in range(start, min(users, start + batch))]
+        with conn:
+            conn.executemany("INSERT INTO legacy_users VALUES (?, ?)", [(name, PASSWORD) for name in names])
+            conn.executemany(
+                "INSERT INTO userstable(username, salt, key, iterations) VALUES (?, ?, ?, ?)",
+                [(name, os.urandom(16), os.urandom(32), auth.PASSWORD_ITERATIONS) for name in names],
+            )
+    with conn:
+        for n in range(real_keys):
+            conn.execute(
+                "UPDATE userstable SET salt = ?, key = ?, iterations = ? WHERE username = ?",
+                (*auth.hash_password(PASSWORD), f"user{n}"),
+            )
+
+
+def measure(fn, args_list):
+    times = []
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def throughput(fn, args_list, threads):
+    chunks = [args_list[i::threads] for i in range(threads)]
+    workers = [threading.Thread(target=lambda c=c: [fn(*a) for a in c]) for c in chunks]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return len(args_list) / (time.perf_counter() - started)
+
+
+def row(label, times, rate=None):
+    rate = f"{rate:12.0f}" if rate is not None else " " * 12
+    print(f"{label:34} {metrics.percentile(times, 50) * 1000:10.3f} {metrics.percentile(times, 95) * 1000:10.3f} {rate}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--logins", type=int, default=20, help="full PBKDF2 logins to time")
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    database.create_usertable()
+    started = time.perf_counter()
+    populate(args.users, args.logins)
+    print(f"Created {args.users} users in {time.perf_counter() - started:.1f}s, "
+          f"database {os.path.getsize(database.DB_PATH) / 1e6:.0f} MB")
+    print(f"{'':34} {'p50 ms':>10} {'p95 ms':>10} {'per second':>12}")
+
+    conn = database.get_conn()
+    names = [(f"user{(n * 7919) % args.users}",) for n in range(2000)]
+
+    def legacy_login(username):
+        return conn.execute(
+            "SELECT * FROM legacy_users WHERE username = ? AND password = ?", (username, PASSWORD)
+        ).fetchone()
+
+    row("old lookup (table scan)", measure(legacy_login, names[:20]))
+
+    def lookup(username):
+        return database.get_conn().execute(
+            "SELECT salt, key, iterations FROM userstable WHERE username = ?", (username,)
+        ).fetchone()
+
+    row("indexed lookup", measure(lookup, names), throughput(lookup, names * 10, args.threads))
+
+    logins = [(f"user{n}", PASSWORD) for n in range(args.logins)]
+    row(f"login_user (PBKDF2 x{auth.PASSWORD_ITERATIONS})", measure(database.login_user, logins),
+        throughput(database.login_user, logins, args.threads))
+
+    store = auth.SessionStore(secrets.token_bytes(32), database.user_exists)
+    tokens = [(store.issue(name),) for (name,) in names]
+    row("session check, LRU hit", measure(store.check, tokens), throughput(store.check, tokens * 50, args.threads))
+
+    cold = auth.SessionStore(store.secret, database.user_exists)
+    row("session check, LRU miss", measure(cold.check, tokens))
+
+
+if __name__ == "__main__":
+    main()
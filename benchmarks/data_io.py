@@ -0,0 +1,77 @@
+"""Throughput of data_io's streaming export and bulk import.
+
+Generates a JSON lines file with --rows records split across the three
+tables, imports it for one user, then exports that user in every format.
+Peak RSS is printed after each step to show memory stays flat.
+
+Run from the repo root:  python -m benchmarks.data_io --rows 1000000
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+workdir = tempfile.mkdtemp()
+os.environ.setdefault("MINDMATE_DB", os.path.join(workdir, "bench.db"))
+
+import data_io  # noqa: E402
+
+MOODS = ["Positive", "Neutral", "Negative"]
+LEVELS = ["None", "Mild", "Moderate", "Moderately Severe", "Severe"]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_source(path, rows, rng):
+    start = datetime(2020, 1, 1)
+    with open(path, "w", encoding="utf-8") as f:
+        for n in range(rows):
+            timestamp = (start + timedelta(seconds=60 * n)).strftime("%Y-%m-%d %H:%M:%S")
+            kind = n % 3
+            if kind == 0:
+                record = {"table": "mood_logs", "mood": rng.choice(MOODS), "note": f"note number {n} about my day", "timestamp": timestamp}
+            elif kind == 1:
+                record = {"table": "phq9_results", "score": rng.randrange(28), "level": rng.choice(LEVELS), "timestamp": timestamp}
+            else:
+                record = {"table": "chat_history", "message": f"message {n}", "response": f"a longer reply to message {n} " * 3, "timestamp": timestamp}
+            f.write(json.dumps(record) + "\n")
+
+
+def report(label, rows, elapsed, path=None):
+    size = f"{os.path.getsize(path) / 1e6:8.1f} MB" if path else " " * 11
+    print(f"{label:22} {rows:9d} rows {elapsed:7.1f}s {rows / elapsed:10.0f} rows/s {size} peak RSS {peak_rss_mb():6.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    source = os.path.join(workdir, "source.jsonl")
+    write_source(source, args.rows, random.Random(1))
+    print(f"Peak RSS after generating the source file: {peak_rss_mb():.0f} MB")
+
+    started = time.perf_counter()
+    count = data_io.import_file("bench", source)
+    report("import jsonl", count, time.perf_counter() - started)
+
+    for name in ("export.jsonl", "export.jsonl.gz", "export.csv", "export.csv.gz"):
+        path = os.path.join(workdir, name)
+        started = time.perf_counter()
+        count = data_io.export_file("bench", path)
+        report(f"export {name[7:]}", count, time.perf_counter() - started, path)
+
+    path = os.path.join(workdir, "export.csv.gz")
+    started = time.perf_counter()
+    count = data_io.import_file("copy", path)
+    report("import csv.gz", count, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    main()
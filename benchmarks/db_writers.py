@@ -0,0 +1,122 @@
+"""Compare the old shared-connection database.py against the pooled one,
+then time a chat history page read on a new thread per operation (as
+Streamlit runs each interaction) with a fresh connection per thread versus a
+connection checked out of the pool.
+
+Run from the repo root:  python -m benchmarks.db_writers --writers 50 --ops 500
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+def run_writers(writers, inserts, save):
+    errors = []
+    barrier = threading.Barrier(writers)
+
+    def worker(i):
+        barrier.wait()
+        for n in range(inserts):
+            try:
+                save(f"user{i}", "Neutral", f"note {n}")
+            except sqlite3.Error as e:
+                errors.append(str(e))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(writers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - started, errors
+
+
+def legacy_saver(path):
+    # The previous design: one connection and cursor shared by every thread,
+    # rollback journal. Without the lock, 50 threads on the shared cursor
+    # crash the interpreter, so this measures its best case.
+    conn = sqlite3.connect(path, check_same_thread=False)
+    c = conn.cursor()
+    c.execute('CREATE TABLE IF NOT EXISTS mood_logs(username TEXT, mood TEXT, note TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)')
+    conn.commit()
+    lock = threading.Lock()
+
+    def save_mood(username, mood, note):
+        with lock:
+            c.execute('INSERT INTO mood_logs(username, mood, note) VALUES (?, ?, ?)', (username, mood, note))
+            conn.commit()
+
+    return save_mood, conn
+
+
+def run_per_thread(ops, op):
+    # Each operation on its own short-lived thread; returns mean ms per op
+    started = time.perf_counter()
+    for _ in range(ops):
+        t = threading.Thread(target=op)
+        t.start()
+        t.join()
+    return (time.perf_counter() - started) / ops * 1000
+
+
+def count_rows(path):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT COUNT(*) FROM mood_logs").fetchone()[0]
+    conn.close()
+    return rows
+
+
+def report(name, writers, inserts, elapsed, errors, rows):
+    total = writers * inserts
+    print(f"{name:8} {elapsed:7.2f}s  {total / elapsed:9.0f} writes/s  {len(errors):5d} errors  {rows}/{total} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=50)
+    parser.add_argument("--inserts", type=int, default=200)
+    parser.add_argument("--ops", type=int, default=500, help="chat page reads, one thread each")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        save, conn = legacy_saver(legacy_path)
+        elapsed, errors = run_writers(args.writers, args.inserts, save)
+        conn.close()
+        report("legacy", args.writers, args.inserts, elapsed, errors, count_rows(legacy_path))
+
+        pooled_path = os.path.join(tmp, "pooled.db")
+        os.environ["MINDMATE_DB"] = pooled_path
+        import database
+
+        database.create_usertable()
+        elapsed, errors = run_writers(args.writers, args.inserts, database.save_mood)
+        database.close_all()
+        report("pooled", args.writers, args.inserts, elapsed, errors, count_rows(pooled_path))
+
+        for n in range(50):
+            database.save_chat("user0", f"message {n}", f"response {n}")
+        database.attach_archive("user0", create=True)
+        database.close_all()
+
+        def fresh_connection():
+            # What every new thread paid before the pool: connect, pragmas,
+            # ATTACH and the archive schema check
+            conn = database._connect(pooled_path)
+            conn.execute('ATTACH DATABASE ? AS archive', (database.archive_path(pooled_path),))
+            database.create_archive_schema(conn, 'archive')
+            conn.execute('SELECT rowid, timestamp FROM chat_history WHERE username = ? ORDER BY timestamp DESC LIMIT 20',
+                         ("user0",)).fetchall()
+            conn.close()
+
+        print(f"{'thread per op':24} {'ms/op':>8}")
+        print(f"{'fresh connection':24} {run_per_thread(args.ops, fresh_connection):8.2f}")
+        print(f"{'pooled get_chat_page':24} {run_per_thread(args.ops, lambda: database.get_chat_page('user0')):8.2f}")
+        database.close_all()
+
+
+if __name__ == "__main__":
+    main()
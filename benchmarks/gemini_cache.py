@@ -0,0 +1,69 @@
+"""Shared Gemini cache across worker processes: several cold workers filling
+their suggestion pools at the same moment (as after a deploy), with no cache,
+with the shared cache, and again after a "restart" with the cache already
+filled. The fake model's latency stands in for Gemini.
+
+Run from the repo root:  python -m benchmarks.gemini_cache --processes 4 --latency 0.5
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+POOL_SIZE = 5
+
+
+def worker(cache_path, latency, barrier, results):
+    from fake_gemini import FakeGenerativeModel
+    from gemini_client import GeminiClient
+    from shared_cache import SharedCache
+    from suggestions import PROMPTS, SuggestionCache
+
+    model = FakeGenerativeModel("gemini-2.5-flash", latency=latency)
+    cache = SharedCache(cache_path) if cache_path else None
+    client = GeminiClient(model, cache=cache, model_name="gemini-2.5-flash")
+    suggestions = SuggestionCache(lambda prompt, variant: client.generate_content(prompt, shared=variant).text,
+                                  pool_size=POOL_SIZE)
+    barrier.wait()
+    started = time.perf_counter()
+    # Keep asking until every sentiment has a full pool
+    while any(suggestions.stats()["pooled"].get(s, 0) < POOL_SIZE for s in PROMPTS):
+        for sentiment in PROMPTS:
+            suggestions.get(sentiment)
+        time.sleep(0.01)
+    results.put((model.calls, time.perf_counter() - started, cache.stats()["hit_rate"] if cache else 0.0))
+
+
+def run(label, processes, cache_path, latency):
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(processes)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=worker, args=(cache_path, latency, barrier, results)) for _ in range(processes)]
+    for w in workers:
+        w.start()
+    stats = [results.get() for _ in workers]
+    for w in workers:
+        w.join()
+    calls = sum(s[0] for s in stats)
+    slowest = max(s[1] for s in stats)
+    hit_rate = sum(s[2] for s in stats) / len(stats)
+    print(f"{label:26} {calls:14d} {slowest:12.2f} {hit_rate * 100:10.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake Gemini seconds per call")
+    args = parser.parse_args()
+
+    cache_path = os.path.join(tempfile.mkdtemp(), "gemini-cache.db")
+    print(f"{args.processes} workers, each: {POOL_SIZE} suggestion lists for 3 moods")
+    print(f"{'':26} {'upstream calls':>14} {'slowest s':>12} {'hit rate':>11}")
+    run("no shared cache", args.processes, "", args.latency)
+    run("shared cache, cold", args.processes, cache_path, args.latency)
+    run("shared cache, restarted", args.processes, cache_path, args.latency)
+
+
+if __name__ == "__main__":
+    main()
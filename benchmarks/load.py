@@ -0,0 +1,190 @@
+"""Concurrent-session load test of the app's hot paths, without Streamlit.
+
+Each simulated session logs in, submits a mood, reads suggestions, takes the
+PHQ-9 screening, chats a few turns and pages its history, calling the same
+functions the app does. Gemini is replaced by fake_gemini with configurable
+latency. Latency percentiles and throughput per path are printed and saved as
+JSON, so runs from two commits can be diffed.
+
+Run from the repo root:
+    python -m benchmarks.load --sessions 50 --rounds 5 --out bench-load.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+os.environ.setdefault("MINDMATE_DB", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import database  # noqa: E402
+import metrics  # noqa: E402
+from auth import SessionStore  # noqa: E402
+from chat import ChatContext, ChatStream  # noqa: E402
+from fake_gemini import FakeGenerativeModel  # noqa: E402
+from gemini_client import GeminiClient  # noqa: E402
+from phq9 import predict_level  # noqa: E402
+from sentiment import detect_sentiment  # noqa: E402
+from suggestions import SuggestionCache  # noqa: E402
+
+MOODS = [
+    "Today was wonderful, I finally finished my project and celebrated with friends!",
+    "It was an ordinary day, classes and then some reading.",
+    "I feel exhausted and lonely, nothing went right today.",
+    "Bit stressed about exams but the walk in the evening helped.",
+]
+CHATS = [
+    "I can't sleep well lately",
+    "How do I stop overthinking?",
+    "I had a fight with my roommate",
+    "Any tips to stay motivated?",
+]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def time(self, path, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.samples[path].append(elapsed)
+        return result
+
+
+def chat_turn(context, username, message):
+    stream = ChatStream(context.chat, message)
+    for _ in stream:
+        pass
+    if stream.completed:
+        context.record(message, stream.text)
+        database.save_chat(username, message, stream.text)
+    return stream
+
+
+def run_session(n, args, client, suggestions, sessions, recorder, rng):
+    # A password login once, then the session token on every later visit
+    username = f"user{n}"
+    recorder.time("login_user", database.login_user, username, "secret")
+    token = sessions.issue(username)
+    for _ in range(args.rounds):
+        recorder.time("session_check", sessions.check, token)
+
+        text = rng.choice(MOODS)
+        sentiment = recorder.time("detect_sentiment", detect_sentiment, text)
+        recorder.time("save_mood", database.save_mood, username, sentiment, text)
+        recorder.time("suggestions", suggestions.get, sentiment)
+
+        answers = [rng.randrange(4) for _ in range(9)]
+        if args.phq9:
+            level = recorder.time("phq9_predict", predict_level, answers)
+        else:
+            level = "Mild"
+        recorder.time("save_phq9", database.save_phq9, username, sum(answers), level)
+
+        context = recorder.time("chat_rehydrate", ChatContext.rehydrate, client, username)
+        for _ in range(args.chat_turns):
+            recorder.time("chat_turn", chat_turn, context, username, rng.choice(CHATS))
+
+        recorder.time("chat_history_page", database.get_chat_page, username)
+
+
+def summarize(samples, wall):
+    report = {}
+    for path, values in sorted(samples.items()):
+        report[path] = {
+            "count": len(values),
+            "p50_ms": metrics.percentile(values, 50) * 1000,
+            "p95_ms": metrics.percentile(values, 95) * 1000,
+            "p99_ms": metrics.percentile(values, 99) * 1000,
+            "ops_per_s": len(values) / wall,
+        }
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--chat-turns", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds before the first chunk")
+    parser.add_argument("--chunk-delay", type=float, default=0.02)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--write-behind", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    database.create_usertable()
+    for n in range(args.sessions):
+        database.add_user(f"user{n}", "secret")
+    if args.write_behind:
+        database.enable_write_behind()
+
+    args.phq9 = os.path.exists("phq9_table.npy")
+    if not args.phq9:
+        print("phq9_table.npy not found (run build_phq9_table.py); skipping phq9_predict")
+
+    model = FakeGenerativeModel(latency=args.llm_latency, chunk_delay=args.chunk_delay,
+                                error_rate=args.llm_error_rate, seed=args.seed)
+    client = GeminiClient(model, max_concurrency=max(8, args.sessions))
+    suggestions = SuggestionCache(lambda prompt, variant: client.generate_content(prompt, shared=variant).text)
+    suggestions.warm()
+    sessions = SessionStore(os.urandom(32), database.user_exists)
+
+    recorder = Recorder()
+    threads = [
+        threading.Thread(target=run_session,
+                         args=(n, args, client, suggestions, sessions, recorder, random.Random(args.seed + n)))
+        for n in range(args.sessions)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    database.disable_write_behind()
+
+    paths = summarize(recorder.samples, wall)
+    print(f"{args.sessions} sessions x {args.rounds} rounds in {wall:.2f}s")
+    print(f"{'path':20} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9}")
+    for path, row in paths.items():
+        print(f"{path:20} {row['count']:6d} {row['p50_ms']:9.2f} {row['p95_ms']:9.2f} {row['p99_ms']:9.2f} {row['ops_per_s']:9.1f}")
+
+    if args.out:
+        result = {
+            "commit": git_commit(),
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "params": {k: v for k, v in vars(args).items() if k != "out"},
+            "wall_seconds": wall,
+            "llm_calls": model.calls,
+            "suggestions": suggestions.stats(),
+            "paths": paths,
+        }
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+        print(f"Saved {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Per-interaction cost of the logged-in app: rerun time, SQL statements run
+and Gemini calls made, using Streamlit's AppTest and the fake Gemini model.
+
+Run from the repo root:  python -m benchmarks.reruns [--app app4.py] [--rounds 5]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+os.environ["MINDMATE_FAKE_GEMINI"] = "1"
+os.environ.setdefault("MINDMATE_DB", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import database  # noqa: E402
+import resources  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+statements = [0]
+_connect = database._connect
+
+
+def _counting_connect(path):
+    conn = _connect(path)
+    conn.set_trace_callback(lambda sql: statements.__setitem__(0, statements[0] + 1))
+    return conn
+
+
+database._connect = _counting_connect
+
+
+def go_to(at, page):
+    # Tabs render every page anyway; the navigation control only shows one
+    nav = [w for w in at.get("button_group") if w.key == "page"]
+    if nav:
+        nav[0].set_value(page)
+
+
+def widget(elements, label):
+    return next(e for e in elements if e.label == label)
+
+
+STEPS = [
+    ("open app", lambda at: None),
+    ("type mood", lambda at: widget(at.text_area, "How was your day today?").input("I feel terrible and sad today")),
+    ("submit mood", lambda at: widget(at.button, "Submit Mood").click()),
+    ("pick action", lambda at: widget(at.radio, "Pick a feel-good action:").set_value("📚 Get a Uplift Tip")),
+    ("open screening", lambda at: go_to(at, "Screening")),
+    ("answer question", lambda at: widget(at.radio, "Feeling down, depressed, or hopeless").set_value("Several days")),
+    ("open history", lambda at: go_to(at, "Chat History")),
+]
+
+
+def run_round(app):
+    at = AppTest.from_file(os.path.abspath(app), default_timeout=30)
+    at.session_state["logged_in"] = True
+    at.session_state["username"] = "bench"
+    model = resources.get("gen_model")
+    results = []
+    for name, action in STEPS:
+        action(at)
+        sql_before, llm_before = statements[0], model.calls
+        started = time.perf_counter()
+        at.run()
+        elapsed = time.perf_counter() - started
+        if at.exception:
+            raise RuntimeError(f"{name}: {at.exception[0].message}")
+        results.append((name, elapsed, statements[0] - sql_before, model.calls - llm_before))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--app", default="app4.py")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    database.create_usertable()
+    for n in range(200):
+        database.save_chat("bench", f"message {n}", f"reply {n}")
+    run_round(args.app)  # warm up resources and caches
+
+    rounds = [run_round(args.app) for _ in range(args.rounds)]
+    print(f"{'interaction':18} {'rerun ms':>9} {'SQL':>5} {'LLM':>5}")
+    for i, (name, *_) in enumerate(STEPS):
+        times = [r[i][1] * 1000 for r in rounds]
+        sql = statistics.mean(r[i][2] for r in rounds)
+        llm = statistics.mean(r[i][3] for r in rounds)
+        print(f"{name:18} {statistics.median(times):9.1f} {sql:5.1f} {llm:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
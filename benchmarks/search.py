@@ -0,0 +1,104 @@
+"""Chat history search: the FTS5 index (database.search_chats) against a
+LIKE scan of the user's rows, for common, rare and missing terms.
+
+Run from the repo root:  python -m benchmarks.search --rows 200000 --other-rows 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("MINDMATE_DB", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import database  # noqa: E402
+import metrics  # noqa: E402
+
+WORDS = (
+    "sleep tired exams stress friends family walk music study work anxious calm "
+    "tea morning evening night weekend class project deadline coffee run gym "
+    "sad happy lonely angry hopeful bored focus break phone book movie dinner"
+).split()
+RARE = "insomnia"
+MISSING = "zeppelin"
+TERMS = {"common": "sleep", "prefix": "exa*", "two words": "tired exams", "rare": RARE, "missing": MISSING}
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def populate(rows, other_rows, rng, batch=10000):
+    # The searched user's chats interleaved with ten other users', as they
+    # would be in a shared database
+    users = ["bench"] * rows + [f"user{n % 10}" for n in range(other_rows)]
+    rng.shuffle(users)
+    start = datetime(2024, 1, 1)
+    for offset in range(0, len(users), batch):
+        chunk = []
+        for n in range(offset, min(len(users), offset + batch)):
+            message = sentence(rng, 8)
+            if n % 5000 == 0:
+                message += " " + RARE
+            timestamp = (start + timedelta(seconds=30 * n)).strftime("%Y-%m-%d %H:%M:%S")
+            chunk.append((users[n], message, sentence(rng, 30), timestamp))
+        with database.get_conn() as conn:
+            database._write_rows(conn, "chat_history", chunk)
+
+
+def like_search(username, text, limit=database.SEARCH_PAGE_SIZE):
+    # What search would be without the index: every term must appear somewhere
+    clauses, params = [], [username]
+    for term in text.split():
+        term = term.rstrip("*")
+        clauses.append("(message LIKE ? OR response LIKE ?)")
+        params += [f"%{term}%", f"%{term}%"]
+    return database.get_conn().execute(
+        "SELECT message, response, timestamp FROM chat_history WHERE username = ? AND "
+        + " AND ".join(clauses) + " ORDER BY timestamp DESC LIMIT ?",
+        (*params, limit + 1),
+    ).fetchall()
+
+
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return metrics.percentile(times, 50) * 1000, metrics.percentile(times, 95) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000, help="chat rows for the searched user")
+    parser.add_argument("--other-rows", type=int, default=100000, help="chat rows spread over other users")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    database.create_usertable()
+    rng = random.Random(1)
+    started = time.perf_counter()
+    populate(args.rows, args.other_rows, rng)
+    loaded = time.perf_counter() - started
+    total = args.rows + args.other_rows
+    print(f"Inserted {total} chats with FTS triggers in {loaded:.1f}s ({total / loaded:.0f} rows/s)")
+    print(f"Database size: {os.path.getsize(database.DB_PATH) / 1e6:.1f} MB")
+    print()
+
+    print(f"Search ranks the newest {database.RANK_WINDOW} matches for the first page; "
+          "LIKE returns the newest matches unranked")
+    print(f"{'term':12} {'hits':>7} {'fts p50':>9} {'fts p95':>9} {'like p50':>9} {'like p95':>9}")
+    for kind, text in TERMS.items():
+        match = database.fts_query(text, "{message response}")
+        hits = database.get_conn().execute(
+            "SELECT COUNT(*) FROM chat_fts WHERE chat_fts MATCH ?", (f'username : "bench" AND {match}',)
+        ).fetchone()[0]
+        fts = measure(lambda: database.search_chats("bench", text), args.repeat)
+        like = measure(lambda: like_search("bench", text), max(1, args.repeat // 4))
+        print(f"{kind:12} {hits:7d} {fts[0]:8.2f}ms {fts[1]:8.2f}ms {like[0]:8.2f}ms {like[1]:8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Resident memory of many mostly idle logged-in sessions, each holding a
+chat context with a live chat session and a few loaded history pages, with
+and without a session memory budget; plus the cost of restoring a spilled
+session when its user comes back.
+
+Run from the repo root:  python -m benchmarks.session_memory --sessions 3000 --budget-mb 20
+"""
+import argparse
+import gc
+import os
+import random
+import time
+
+import metrics
+from chat import ChatContext
+from fake_gemini import FakeGenerativeModel
+from session_store import SessionMemoryManager, identity_codec
+
+WORDS = (
+    "i have been feeling stressed about exams and i could not sleep well so i tried "
+    "a short walk and some breathing which helped a little but i still worry a lot"
+).split()
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def run(label, sessions, budget, model, rng):
+    manager = SessionMemoryManager({
+        "chat_context": (ChatContext.dump, lambda data: ChatContext.load(model, data)),
+        "history_rows": identity_codec(),
+        "history_cursor": identity_codec(),
+    }, budget=budget, min_idle=0)
+    gc.collect()
+    before = rss_mb()
+    started = time.perf_counter()
+    for n in range(sessions):
+        slots = manager.slots(f"session-{n:06d}")
+        turns = [(sentence(rng, 25), sentence(rng, 80)) for _ in range(rng.randint(5, 15))]
+        slots["chat_context"] = ChatContext(model, turns)
+        slots["history_rows"] = [(sentence(rng, 25), sentence(rng, 80), "2026-01-01 12:00:00") for _ in range(40)]
+        slots["history_cursor"] = ("2026-01-01 12:00:00", 1)
+        manager.enforce()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    report = manager.report()
+    print(f"{label:16} {report['live_sessions']:6d} {report['spilled_sessions']:8d} "
+          f"{report['live_bytes'] / 1e6:10.1f} {rss_mb() - before:9.1f} "
+          f"{report['spilled_disk_bytes'] / 1e6:8.1f} {elapsed / sessions * 1000:9.3f}")
+
+    times = []
+    for n in rng.sample(range(sessions), min(200, sessions)):
+        started = time.perf_counter()
+        manager.get(f"session-{n:06d}", "chat_context")
+        times.append(time.perf_counter() - started)
+        manager.enforce()
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=3000)
+    parser.add_argument("--budget-mb", type=float, default=20)
+    args = parser.parse_args()
+
+    model = FakeGenerativeModel()
+    print(f"{'':16} {'live':>6} {'spilled':>8} {'est. MB':>10} {'RSS +MB':>9} {'disk MB':>8} {'ms/rerun':>9}")
+    unbounded = run("no budget", args.sessions, float("inf"), model, random.Random(1))
+    bounded = run(f"{args.budget_mb:g} MB budget", args.sessions, args.budget_mb * 1024 * 1024, model, random.Random(1))
+    print()
+    print(f"{'returning user':16} {'p50 ms':>8} {'p95 ms':>8}")
+    for label, times in (("live", unbounded), ("restored", bounded)):
+        print(f"{label:16} {metrics.percentile(times, 50) * 1000:8.3f} {metrics.percentile(times, 95) * 1000:8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Single-file against sharded storage: several worker processes saving for
+their own users at once (as Streamlit workers behind a load balancer would),
+then the cross-shard admin queries run in parallel and one shard at a time.
+
+Run from the repo root:  python -m benchmarks.shards --processes 4 --shards 4
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+
+def writer(storage_env, process, users, saves, results):
+    # Runs in a fresh process, so storage is picked up from the environment
+    os.environ.update(storage_env)
+    import database
+    import metrics
+
+    times = []
+    for n in range(saves):
+        username = f"p{process}-user{n % users}"
+        started = time.perf_counter()
+        database.save_chat(username, f"message {n}", "a reply of a few words " * 20)
+        times.append(time.perf_counter() - started)
+    results.put((metrics.percentile(times, 50), metrics.percentile(times, 99), sum(times)))
+
+
+def run(label, storage_env, processes, users, saves):
+    os.environ.update(storage_env)
+    import database
+
+    database.configure_storage(database.storage_from_env())
+    database.create_usertable()
+    database.close_all()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    workers = [ctx.Process(target=writer, args=(storage_env, p, users, saves, results)) for p in range(processes)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    stats = [results.get() for _ in workers]
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    p50 = max(s[0] for s in stats) * 1000
+    p99 = max(s[1] for s in stats) * 1000
+    print(f"{label:22} {processes * saves / elapsed:10.0f} {p50:10.2f} {p99:10.2f}")
+
+
+def admin(label):
+    import database
+
+    database.configure_storage(database.storage_from_env())
+    import shards as shard_tools
+
+    def queries(parallel):
+        database.for_each_shard(shard_tools._shard_stats, parallel=parallel)
+        database.for_each_shard(
+            lambda path: database.get_conn(path=path).execute(
+                "SELECT username, COUNT(*) FROM chat_history GROUP BY username ORDER BY 2 DESC LIMIT 10"
+            ).fetchall(),
+            parallel=parallel,
+        )
+
+    queries(False)  # warm the page cache and open the pool threads' connections
+    queries(True)
+    for parallel in (False, True):
+        started = time.perf_counter()
+        queries(parallel)
+        print(f"  {label} admin stats + top users, {'parallel' if parallel else 'one shard at a time':20} "
+              f"{(time.perf_counter() - started) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--users", type=int, default=50, help="users per process")
+    parser.add_argument("--saves", type=int, default=2000, help="saves per process")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    single = {"MINDMATE_DB": os.path.join(tmp, "single.db"), "MINDMATE_SHARDS": ""}
+    sharded = {"MINDMATE_SHARDS": ",".join(os.path.join(tmp, f"shard{n}.db") for n in range(args.shards))}
+
+    print(f"{os.cpu_count()} CPUs, {args.processes} writer processes")
+    print(f"{'':22} {'saves/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    run("single file", single, args.processes, args.users, args.saves)
+    run(f"{args.shards} shards", sharded, args.processes, args.users, args.saves)
+    print()
+    os.environ.update(single)
+    admin("single file")
+    os.environ.update(sharded)
+    admin(f"{args.shards} shards")
+
+
+if __name__ == "__main__":
+    main()
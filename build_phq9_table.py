@@ -0,0 +1,101 @@
+import json
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from phq9 import NUM_OPTIONS, NUM_QUESTIONS, TABLE_FORMAT, TABLE_PATH, META_PATH, answers_to_index, sha256_file
+
+# Run the trained model once over every possible answer vector (4^9 = 262,144)
+# and store the predicted level of each as a uint8 code, so the app can look
+# predictions up by index instead of running the forest per submission.
+
+MODEL_PATH = "phq9_model.pkl"
+MODEL_META_PATH = "phq9_model.json"
+CHUNK_SIZE = 65536
+SAMPLE_SIZE = 5000
+
+
+def load_model(model_path=MODEL_PATH, meta_path=MODEL_META_PATH):
+    # Refuse a model that isn't the one model.py described in its metadata
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if sha256_file(model_path) != meta["sha256"]:
+        raise ValueError(f"{model_path} does not match the checksum in {meta_path}; rerun model.py")
+    return joblib.load(model_path), meta
+
+
+def all_answer_vectors():
+    # Row i holds the answers whose base-4 encoding is i (Q1 most significant)
+    shape = (NUM_OPTIONS,) * NUM_QUESTIONS
+    return np.array(np.unravel_index(np.arange(NUM_OPTIONS ** NUM_QUESTIONS), shape), dtype=np.uint8).T
+
+
+def model_input(model, vectors):
+    # The model was fitted on a DataFrame, so keep its feature names
+    columns = getattr(model, "feature_names_in_", None)
+    if columns is None:
+        return vectors
+    return pd.DataFrame(vectors, columns=columns)
+
+
+def build_table(model):
+    labels = [str(label) for label in model.classes_]
+    vectors = all_answer_vectors()
+    codes = np.empty(len(vectors), dtype=np.uint8)
+    for start in range(0, len(vectors), CHUNK_SIZE):
+        chunk = vectors[start:start + CHUNK_SIZE]
+        predicted = model.predict(model_input(model, chunk))
+        codes[start:start + CHUNK_SIZE] = np.searchsorted(model.classes_, predicted)
+    return codes, labels
+
+
+def verify_table(model, table_path=TABLE_PATH, meta_path=META_PATH, sample_size=SAMPLE_SIZE, seed=7):
+    table = np.load(table_path, mmap_mode="r")
+    with open(meta_path) as f:
+        labels = json.load(f)["labels"]
+
+    rng = np.random.default_rng(seed)
+    sample = rng.integers(0, NUM_OPTIONS, (sample_size, NUM_QUESTIONS))
+    expected = model.predict(model_input(model, sample))
+
+    mismatches = 0
+    for answers, label in zip(sample, expected):
+        if labels[table[answers_to_index(answers)]] != label:
+            mismatches += 1
+    return mismatches
+
+
+def write_table(model, model_meta):
+    codes, labels = build_table(model)
+    np.save(TABLE_PATH, codes)
+    meta = {
+        "format": TABLE_FORMAT,
+        "labels": labels,
+        "questions": NUM_QUESTIONS,
+        "options": NUM_OPTIONS,
+        "sha256": sha256_file(TABLE_PATH),
+        "model_version": model_meta["version"],
+        "model_candidate": model_meta["candidate"],
+        "model_sha256": model_meta["sha256"],
+    }
+    with open(META_PATH, "w") as f:
+        json.dump(meta, f, indent=2)
+    return codes
+
+
+def main():
+    model, model_meta = load_model()
+    codes = write_table(model, model_meta)
+    print(f"Wrote {len(codes)} predictions to {TABLE_PATH} ({codes.nbytes} bytes)")
+
+    mismatches = verify_table(model)
+    if mismatches:
+        print(f"Table disagrees with model.predict on {mismatches}/{SAMPLE_SIZE} sampled answers")
+        sys.exit(1)
+    print(f"Table matches model.predict on {SAMPLE_SIZE} sampled answers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger("mindmate")
+
+# Shown (not saved) when no reply could be fetched at all
+CANNED_REPLY = (
+    "I'm having trouble thinking right now, but I'm still here with you. 💜 "
+    "Take a slow breath, and try sending that again in a little while."
+)
+
+
+class ChatStream:
+    # Iterates over the text chunks of one streamed chat reply, e.g. for
+    # st.write_stream. Afterwards, `completed` tells whether the whole reply
+    # arrived and `text` holds it. A reply that fails or is cancelled half way
+    # is rewound out of the chat session, so the next message doesn't build
+    # on a broken turn.
+
+    def __init__(self, chat, message):
+        self.chat = chat
+        self.message = message
+        self.text = ""
+        self.completed = False
+        self.error = None
+        self.ttft = None
+        self.total = None
+
+    def __iter__(self):
+        started = time.perf_counter()
+        response = None
+        parts = []
+        try:
+            response = self.chat.send_message(self.message, stream=True)
+            for chunk in response:
+                if self.ttft is None:
+                    self.ttft = time.perf_counter() - started
+                    metrics.observe("chat.ttft_seconds", self.ttft)
+                parts.append(chunk.text)
+                yield chunk.text
+        except Exception as e:
+            self.error = e
+            self._abort(response, "failed")
+            logger.warning("Chat stream failed after %d chunks: %s", len(parts), e)
+            return
+        except BaseException:
+            # Streamlit stops a running script with an exception when the user
+            # interacts mid-stream; treat it as a cancel and let it propagate
+            self._abort(response, "cancelled")
+            raise
+        finally:
+            self.text = "".join(parts)
+
+        self.completed = True
+        self.total = time.perf_counter() - started
+        metrics.observe("chat.total_seconds", self.total)
+        metrics.incr("chat.streams.completed")
+
+    def _abort(self, response, outcome):
+        metrics.incr(f"chat.streams.{outcome}")
+        if response is not None:
+            try:
+                self.chat.rewind()
+            except Exception:
+                logger.debug("Could not rewind chat after a %s stream", outcome, exc_info=True)
+
+
+# ------------------- BOUNDED CONTEXT -------------------
+# A chat session resends its whole history with every message. ChatContext
+# keeps the recent turns verbatim within a token budget and folds older turns
+# into a rolling summary, so each message costs about the same however long
+# the user has been chatting. It can also be rebuilt from chat_history rows,
+# so context survives logout. Summaries are written in the background: until
+# one is ready the context carries the previous summary and the recent turns,
+# and the new summary is swapped in after the next recorded turn.
+CONTEXT_TOKEN_BUDGET = 2000
+SUMMARY_MAX_CHARS = 1200
+REHYDRATE_TURNS = 40
+SUMMARY_CACHE_SIZE = 1000
+
+SUMMARY_PROMPT = (
+    "Summarize this conversation between a user and a supportive AI friend in at most "
+    "120 words. Keep names, feelings and facts the user shared that would matter later.\n\n"
+    "{previous}{turns}"
+)
+
+_summary_cache = OrderedDict()
+_summary_cache_lock = threading.Lock()
+_summary_pool = ThreadPoolExecutor(2, thread_name_prefix="mindmate-summary")
+
+
+def estimate_tokens(text):
+    # Rough but cheap: about four characters per token for English text
+    return len(text) // 4 + 1
+
+
+def turn_tokens(turn):
+    return estimate_tokens(turn[0]) + estimate_tokens(turn[1])
+
+
+def _cached_summary(key):
+    with _summary_cache_lock:
+        summary = _summary_cache.get(key)
+        if summary is not None:
+            _summary_cache.move_to_end(key)
+        return summary
+
+
+def _store_summary(key, summary):
+    with _summary_cache_lock:
+        _summary_cache[key] = summary
+        _summary_cache.move_to_end(key)
+        while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+
+
+def summarize(model, previous, turns):
+    # Cached by content, so rehydrating the same history again is free
+    key = hashlib.sha256(repr((previous, turns)).encode("utf-8")).hexdigest()
+    summary = _cached_summary(key)
+    if summary is not None:
+        metrics.incr("chat.summary.cache_hits")
+        return summary
+
+    lines = "\n".join(f"User: {message}\nAI: {response}" for message, response in turns)
+    prompt = SUMMARY_PROMPT.format(
+        previous=f"Earlier summary: {previous}\n\n" if previous else "",
+        turns=lines,
+    )
+    try:
+        # An over-long summary loses its end, not its opening
+        summary = model.generate_content(prompt).text.strip()[:SUMMARY_MAX_CHARS]
+        metrics.incr("chat.summary.generated")
+    except Exception as e:
+        # Keep going without the model: the user's own words, keeping the most recent
+        logger.warning("Chat summary failed, keeping an extract instead: %s", e)
+        summary = " ".join([previous] + [message for message, _ in turns]).strip()[-SUMMARY_MAX_CHARS:]
+        metrics.incr("chat.summary.failed")
+
+    _store_summary(key, summary)
+    return summary
+
+
+class ChatContext:
+    def __init__(self, model, turns=(), summary="", budget=CONTEXT_TOKEN_BUDGET, pending=()):
+        self.model = model
+        self.budget = budget
+        self.summary = summary
+        self.turns = list(turns)
+        # Turns folded away whose summary is still being written
+        self.pending = []
+        self._summary = None
+        if pending:
+            self._summarize(list(pending))
+        self._fold()
+        self.chat = model.start_chat(history=self.history())
+
+    @classmethod
+    def rehydrate(cls, model, username, turns=REHYDRATE_TURNS, budget=CONTEXT_TOKEN_BUDGET):
+        from database import get_chat_page
+
+        rows, _ = get_chat_page(username, limit=turns)
+        return cls(model, [(message, response) for message, response, _ in reversed(rows)], budget=budget)
+
+    def dump(self):
+        # Plain data for session_store; load() rebuilds the chat session from
+        # it. Called on every measure, so it only reads: a finished summary is
+        # written out but swapped in by record(), which also rebuilds the chat.
+        summary, pending = self.summary, self.pending
+        if self._summary is not None and self._summary.done():
+            summary, pending = self._summary.result(), []
+        return {"turns": self.turns, "summary": summary, "budget": self.budget, "pending": pending}
+
+    @classmethod
+    def load(cls, model, data):
+        return cls(model, [tuple(turn) for turn in data["turns"]], data["summary"], data["budget"],
+                   [tuple(turn) for turn in data.get("pending", ())])
+
+    def history(self):
+        contents = []
+        if self.summary:
+            contents.append({"role": "user", "parts": [f"Summary of our earlier conversation: {self.summary}"]})
+            contents.append({"role": "model", "parts": ["Thanks, I'll keep that in mind."]})
+        for message, response in self.turns:
+            contents.append({"role": "user", "parts": [message]})
+            contents.append({"role": "model", "parts": [response]})
+        return contents
+
+    def tokens(self):
+        return estimate_tokens(self.summary) + sum(turn_tokens(turn) for turn in self.turns)
+
+    def record(self, message, response):
+        # The chat session already holds this turn; only rebuild it on a fold
+        # or when a new summary is ready
+        self.turns.append((message, response))
+        taken = self._take_summary()
+        if self._fold() or taken:
+            self.chat = self.model.start_chat(history=self.history())
+
+    def _summarize(self, older):
+        # Caller's thread only; the summary is written on _summary_pool
+        self.pending = self.pending + older
+        self._summary = _summary_pool.submit(summarize, self.model, self.summary, self.pending)
+
+    def _take_summary(self):
+        if self._summary is None or not self._summary.done():
+            return False
+        self.summary, self.pending, self._summary = self._summary.result(), [], None
+        return True
+
+    def _fold(self):
+        if self.tokens() <= self.budget or len(self.turns) < 2:
+            return False
+        # Fold the older half at once so summaries happen every few turns,
+        # not on every message once the budget is reached
+        keep = len(self.turns) // 2
+        while keep > 1 and sum(turn_tokens(turn) for turn in self.turns[-keep:]) > self.budget // 2:
+            keep -= 1
+        older, self.turns = self.turns[:-keep], self.turns[-keep:]
+        self._summarize(older)
+        return True
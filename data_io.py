@@ -0,0 +1,180 @@
+import argparse
+import csv
+import gzip
+import io
+import json
+import sys
+import tempfile
+import time
+
+from database import (
+    ARCHIVE_ONLY, INSERTS, attach_archive, create_usertable, get_conn, rebuild_rollups, unpack, wait_for_user_writes,
+)
+from metrics import timed
+
+# Streaming export and bulk import of one user's mood_logs, phq9_results and
+# chat_history, as JSON lines or CSV, optionally gzipped. Rows go straight
+# from the SQLite cursor to the file (and back), so memory stays flat
+# whatever the size of the history. The username isn't exported; an import
+# files the rows under whichever user it is given.
+#
+#   python data_io.py export alice alice.jsonl.gz
+#   python data_io.py import bob alice.jsonl.gz
+
+TABLES = {
+    'mood_logs': ('mood', 'note', 'timestamp'),
+    'phq9_results': ('score', 'level', 'timestamp'),
+    'chat_history': ('message', 'response', 'timestamp'),
+}
+# One CSV layout for all three tables; columns a table doesn't have are empty
+CSV_COLUMNS = ['table', 'mood', 'note', 'score', 'level', 'message', 'response', 'timestamp']
+IMPORT_BATCH_SIZE = 5000
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+def format_for(path):
+    # "history.csv.gz" -> ("csv", True)
+    compressed = path.endswith('.gz')
+    name = path[:-3] if compressed else path
+    return ('csv' if name.endswith('.csv') else 'jsonl'), compressed
+
+
+# ------------------- EXPORT -------------------
+ARCHIVED_TABLES = ('mood_logs', 'chat_history')
+
+
+def iter_records(username, tables=TABLES):
+    # Yields (table, row), archived rows first, each row once even if it is
+    # mid-move; the cursors are iterated, not fetchall()ed
+    wait_for_user_writes(username)
+    archived = attach_archive(username)
+    conn = get_conn(username)
+    for table in tables:
+        columns = ", ".join(TABLES[table])
+        if archived and table in ARCHIVED_TABLES:
+            cursor = conn.execute(
+                f'SELECT {", ".join(f"a.{c}" for c in TABLES[table])} FROM archive.{table} AS a '
+                f'WHERE a.username = ? AND {ARCHIVE_ONLY.format(table=table)} ORDER BY a.timestamp, a.id',
+                (username,),
+            )
+            for row in cursor:
+                yield table, tuple(map(unpack, row))
+        cursor = conn.execute(f'SELECT {columns} FROM main.{table} WHERE username = ? ORDER BY rowid', (username,))
+        for row in cursor:
+            yield table, row
+
+
+@timed('data_io.export')
+def write_export(username, binary_file, fmt='jsonl', compress=False, tables=TABLES):
+    # Writes into an open binary file; returns the number of rows written
+    raw = gzip.GzipFile(fileobj=binary_file, mode='wb') if compress else binary_file
+    out = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+    count = 0
+    try:
+        if fmt == 'csv':
+            writer = csv.DictWriter(out, CSV_COLUMNS)
+            writer.writeheader()
+            for table, row in iter_records(username, tables):
+                writer.writerow({'table': table, **dict(zip(TABLES[table], row))})
+                count += 1
+        else:
+            for table, row in iter_records(username, tables):
+                out.write(json.dumps({'table': table, **dict(zip(TABLES[table], row))}, ensure_ascii=False))
+                out.write('\n')
+                count += 1
+        out.flush()
+    finally:
+        # Close the gzip stream (writes its trailer) but leave the caller's file open
+        out.detach()
+        if compress:
+            raw.close()
+    return count
+
+
+def export_bytes(username, fmt='jsonl', compress=False):
+    # For st.download_button: build the file in a spooled temporary file,
+    # which moves to disk past SPOOL_MAX_SIZE, then hand over its bytes
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+        write_export(username, spool, fmt, compress)
+        spool.seek(0)
+        return spool.read()
+
+
+def export_file(username, path):
+    fmt, compress = format_for(path)
+    with open(path, 'wb') as f:
+        return write_export(username, f, fmt, compress)
+
+
+# ------------------- IMPORT -------------------
+def read_records(binary_file, fmt='jsonl', compress=False):
+    # Yields (table, row) in the column order of TABLES[table]
+    raw = gzip.GzipFile(fileobj=binary_file, mode='rb') if compress else binary_file
+    text = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+    records = csv.DictReader(text) if fmt == 'csv' else (json.loads(line) for line in text if line.strip())
+    for number, record in enumerate(records, 1):
+        table = record.get('table')
+        if table not in TABLES:
+            raise ValueError(f'Record {number}: unknown table {table!r}')
+        row = tuple(record.get(column) for column in TABLES[table])
+        if table == 'phq9_results':
+            # CSV has no types; scores go back in as integers
+            row = (int(row[0]),) + row[1:]
+        yield table, row
+
+
+@timed('data_io.import')
+def import_records(username, records, batch_size=IMPORT_BATCH_SIZE):
+    # One transaction for the whole import: it lands completely or not at all.
+    # Rows are buffered per table and written with executemany; the daily
+    # rollups are rebuilt for the user once at the end instead of per row.
+    create_usertable()
+    attach_archive(username)
+    wait_for_user_writes(username)
+    batches = {table: [] for table in TABLES}
+    count = 0
+    with get_conn(username) as conn:
+        for table, row in records:
+            batch = batches[table]
+            batch.append((username,) + row)
+            if len(batch) >= batch_size:
+                conn.executemany(INSERTS[table], batch)
+                batch.clear()
+            count += 1
+        for table, batch in batches.items():
+            if batch:
+                conn.executemany(INSERTS[table], batch)
+        rebuild_rollups(conn, username)
+    return count
+
+
+def import_file(username, path):
+    fmt, compress = format_for(path)
+    with open(path, 'rb') as f:
+        return import_records(username, read_records(f, fmt, compress))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import one user's moods, screenings and chats.")
+    parser.add_argument('action', choices=['export', 'import'])
+    parser.add_argument('username')
+    parser.add_argument('path', help='.jsonl or .csv, optionally .gz; "-" for stdout/stdin as JSON lines')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.path == '-':
+        if args.action == 'export':
+            count = write_export(args.username, sys.stdout.buffer)
+        else:
+            count = import_records(args.username, read_records(sys.stdin.buffer))
+    elif args.action == 'export':
+        count = export_file(args.username, args.path)
+    else:
+        count = import_file(args.username, args.path)
+    elapsed = time.perf_counter() - started
+    print(f'{args.action.capitalize()}ed {count} rows in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/s)',
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,63 +1,913 @@
+import atexit
+import bisect
+import hashlib
+import logging
+import os
+import queue
 import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
-# Create user table
-def create_usertable():
-    conn = sqlite3.connect('users.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            username TEXT PRIMARY KEY,
-            password TEXT
+from auth import MIGRATION_ITERATIONS, PASSWORD_ITERATIONS, SALT_BYTES, hash_password, verify_password
+from metrics import span, timed
+
+logger = logging.getLogger("mindmate")
+
+# ------------------- CONNECTION POOL -------------------
+# A thread checks out its own connection per database file on first use and
+# keeps it until the thread exits, so it never shares a connection or cursor.
+# Streamlit runs almost every interaction on a new thread; when it exits, its
+# connections go back to a per-file pool of ready connections (pragmas set,
+# archive attached) for the next thread, instead of being closed. WAL lets
+# readers and the writer proceed concurrently, and busy_timeout makes a
+# writer wait for the lock rather than failing with "database is locked".
+DB_PATH = os.environ.get("MINDMATE_DB", "users.db")
+BUSY_TIMEOUT_MS = 5000
+PRAGMAS = (
+    # Only takes effect on a new database; archive.py converts existing ones
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=67108864",
+)
+
+POOL_IDLE = 8
+
+_local = threading.local()
+_idle = {}  # path -> ready connections, most recently used last
+_open = {}  # every connection opened here -> its path
+_archived = set()  # connections with their archive attached
+_pool_lock = threading.Lock()
+# Bumped by close_all(), so other threads drop their closed connections too
+_generation = 0
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    # The archive's full-text index reads and writes through unpack() (see ARCHIVE_SCHEMA)
+    conn.create_function('unpack', 1, unpack, deterministic=True)
+    return conn
+
+
+# ------------------- STORAGE BACKENDS -------------------
+# Every table is keyed by username, so a user's rows can live in any one
+# SQLite file. SingleFileStorage (the default) keeps everyone in DB_PATH.
+# ShardedStorage spreads users over several files by consistent hashing, so
+# worker processes writing for different users don't queue on one file lock.
+# MINDMATE_SHARDS="shards/a.db,shards/b.db,..." selects sharded mode; after
+# changing the list, run `python shards.py rebalance`.
+class SingleFileStorage:
+    def __init__(self, path):
+        self.paths = [path]
+
+    def path_for(self, username):
+        return self.paths[0]
+
+
+def _ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class ShardedStorage:
+    # Each shard owns VNODES points on a hash ring, named after its file
+    # name (not its directory), and a user belongs to the first point at or
+    # after the hash of their name. Adding a shard moves only ~1/N of users.
+    VNODES = 128
+
+    def __init__(self, paths):
+        if len({os.path.basename(path) for path in paths}) != len(paths):
+            raise ValueError('Shard files need distinct names')
+        self.paths = list(paths)
+        ring = sorted(
+            (_ring_hash(f'{os.path.basename(path)}#{i}'), path) for path in self.paths for i in range(self.VNODES)
         )
-    ''')
-    conn.commit()
-    conn.close()
+        self._points = [point for point, _ in ring]
+        self._owners = [path for _, path in ring]
 
-# Add a new user
-def add_user(username, password):
-    conn = sqlite3.connect('users.db')
-    c = conn.cursor()
-    c.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, password))
-    conn.commit()
-    conn.close()
+    def path_for(self, username):
+        index = bisect.bisect_left(self._points, _ring_hash(username))
+        return self._owners[index % len(self._owners)]
 
-# Login check
-def login_user(username, password):
-    conn = sqlite3.connect('users.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM users WHERE username = ? AND password = ?', (username, password))
-    data = c.fetchone()
+
+def storage_from_env():
+    shards = [path.strip() for path in os.environ.get("MINDMATE_SHARDS", "").split(",") if path.strip()]
+    return ShardedStorage(shards) if shards else SingleFileStorage(DB_PATH)
+
+
+_storage = storage_from_env()
+
+
+def configure_storage(storage):
+    # For tools and benchmarks; call before any connection is opened
+    global _storage
+    close_all()
+    _storage = storage
+
+
+def shard_paths():
+    return list(_storage.paths)
+
+
+def shard_for(username):
+    return _storage.path_for(username)
+
+
+def _resolve(username, path):
+    # A user's shard, or the given file; without either only single-file
+    # mode has an answer
+    if path is not None:
+        return path
+    if username is not None:
+        return _storage.path_for(username)
+    if len(_storage.paths) == 1:
+        return _storage.paths[0]
+    raise ValueError('Sharded storage: pass a username or a shard path')
+
+
+def _check_out(path):
+    with _pool_lock:
+        idle = _idle.get(path)
+        if idle:
+            return idle.pop()
+    conn = _connect(path)
+    with _pool_lock:
+        _open[conn] = path
+    return conn
+
+
+def _check_in(path, conn, generation):
+    try:
+        # A thread that died mid-transaction leaves it open
+        if conn.in_transaction:
+            conn.rollback()
+    except sqlite3.Error:
+        generation = None
+    with _pool_lock:
+        idle = _idle.setdefault(path, [])
+        if generation == _generation and conn in _open and len(idle) < POOL_IDLE:
+            idle.append(conn)
+            return
+        _open.pop(conn, None)
+        _archived.discard(conn)
     conn.close()
-    return data
 
-import sqlite3
 
-conn = sqlite3.connect('users.db', check_same_thread=False)
-c = conn.cursor()
+class _Lease:
+    # The connections a thread has checked out. Its thread-local data is
+    # dropped when the thread exits, which checks them back in.
+    def __init__(self):
+        self.conns = {}
+        self.generation = _generation
+
+    def __del__(self):
+        for path, conn in self.conns.items():
+            try:
+                _check_in(path, conn, self.generation)
+            except Exception:
+                # Interpreter shutdown; close_all() has run
+                pass
+
+
+def get_conn(username=None, path=None):
+    path = _resolve(username, path)
+    lease = getattr(_local, "lease", None)
+    if lease is None or lease.generation != _generation:
+        lease = _local.lease = _Lease()
+    conn = lease.conns.get(path)
+    if conn is None:
+        conn = lease.conns[path] = _check_out(path)
+    return conn
+
+
+_shard_pool = None
+_shard_pool_lock = threading.Lock()
+
+
+def for_each_shard(fn, parallel=True):
+    # Runs fn(path) for every shard, on a pool with a thread per shard (SQLite
+    # releases the GIL while it works); returns {path: result}. The pool
+    # lives as long as the process, so its threads keep their connections.
+    global _shard_pool
+    paths = shard_paths()
+    if not parallel or len(paths) == 1:
+        return {path: fn(path) for path in paths}
+    with _shard_pool_lock:
+        if _shard_pool is None or _shard_pool._max_workers < len(paths):
+            _shard_pool = ThreadPoolExecutor(max_workers=len(paths), thread_name_prefix='mindmate-shard')
+    return dict(zip(paths, _shard_pool.map(fn, paths)))
+
+
+# ------------------- ARCHIVE TIER -------------------
+# archive.py moves old chat_history and mood_logs rows into a second SQLite
+# file per database, attached to its connections as "archive". Rows there
+# are clustered by (username, timestamp, id), where id is the row's rowid in
+# the main table (negative for rows a rebalance brought in from another
+# shard, see shards._move). Long texts are stored zlib-compressed as BLOBs
+# (see pack/unpack). Each archive has its own full-text indexes, over views
+# that unpack the texts, so search still finds archived rows.
+# MINDMATE_ARCHIVE_DB overrides the path in single-file mode.
+ARCHIVE_PATH = os.environ.get("MINDMATE_ARCHIVE_DB", os.path.splitext(DB_PATH)[0] + "-archive.db")
+ARCHIVE_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS {schema}.chat_history(username TEXT NOT NULL, timestamp TEXT NOT NULL, '
+    'id INTEGER NOT NULL, message, response, PRIMARY KEY (username, timestamp, id)) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS {schema}.mood_logs(username TEXT NOT NULL, timestamp TEXT NOT NULL, '
+    'id INTEGER NOT NULL, mood TEXT, note, PRIMARY KEY (username, timestamp, id)) WITHOUT ROWID',
+    # Full-text search, as in migration 3; the index rowid is the row's id
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_chat_history_id ON chat_history(id)',
+    'CREATE VIEW IF NOT EXISTS {schema}.chat_text AS '
+    'SELECT id, username, unpack(message) AS message, unpack(response) AS response FROM chat_history',
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.chat_fts USING fts5(username, message, response, "
+    "content='chat_text', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')",
+    'CREATE TRIGGER IF NOT EXISTS {schema}.chat_fts_insert AFTER INSERT ON chat_history BEGIN '
+    'INSERT INTO chat_fts(rowid, username, message, response) '
+    'VALUES (new.id, new.username, unpack(new.message), unpack(new.response)); END',
+    'CREATE TRIGGER IF NOT EXISTS {schema}.chat_fts_delete AFTER DELETE ON chat_history BEGIN '
+    "INSERT INTO chat_fts(chat_fts, rowid, username, message, response) "
+    "VALUES ('delete', old.id, old.username, unpack(old.message), unpack(old.response)); END",
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_mood_logs_id ON mood_logs(id)',
+    'CREATE VIEW IF NOT EXISTS {schema}.mood_text AS SELECT id, username, unpack(note) AS note FROM mood_logs',
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.mood_fts USING fts5(username, note, "
+    "content='mood_text', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')",
+    'CREATE TRIGGER IF NOT EXISTS {schema}.mood_fts_insert AFTER INSERT ON mood_logs BEGIN '
+    'INSERT INTO mood_fts(rowid, username, note) VALUES (new.id, new.username, unpack(new.note)); END',
+    'CREATE TRIGGER IF NOT EXISTS {schema}.mood_fts_delete AFTER DELETE ON mood_logs BEGIN '
+    "INSERT INTO mood_fts(mood_fts, rowid, username, note) VALUES ('delete', old.id, old.username, unpack(old.note)); END",
+)
+# Filter for archive rows (aliased a) that aren't also still in main. A row
+# caught mid-move (see archive._archive_shard) is in both tiers for a moment,
+# with the archive id equal to the main rowid.
+ARCHIVE_ONLY = (
+    'NOT EXISTS (SELECT 1 FROM main.{table} AS m WHERE m.rowid = a.id '
+    'AND m.username = a.username AND m.timestamp = a.timestamp)'
+)
+PACK_MIN_LENGTH = 64
+
+
+def archive_path(path):
+    if path == DB_PATH:
+        return ARCHIVE_PATH
+    return os.path.splitext(path)[0] + "-archive.db"
+
+
+def pack(text):
+    # Compressed only when that actually saves space; short texts stay TEXT
+    if text is None or len(text) < PACK_MIN_LENGTH:
+        return text
+    raw = text.encode('utf-8')
+    packed = zlib.compress(raw, 6)
+    return packed if len(packed) < len(raw) else text
+
+
+def unpack(value):
+    return zlib.decompress(value).decode('utf-8') if isinstance(value, bytes) else value
+
+
+def create_archive_schema(conn, schema):
+    conn.execute(f'PRAGMA {schema}.auto_vacuum=INCREMENTAL')
+    conn.execute(f'PRAGMA {schema}.journal_mode=WAL')
+    with conn:
+        indexed = conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'chat_fts'").fetchone()
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement.format(schema=schema))
+        if indexed is None:
+            # Archives written before they had an index
+            for fts in ('chat_fts', 'mood_fts'):
+                conn.execute(f"INSERT INTO {schema}.{fts}({fts}) VALUES ('rebuild')")
+
+
+def attach_archive(username=None, path=None, create=False):
+    # Attaches the archive of a user's (or a file's) database to this
+    # thread's connection if it exists, or create=True; returns whether it
+    # is attached. ATTACH can't run inside a transaction, so callers do this
+    # before opening one. It stays attached while the connection is pooled.
+    path = _resolve(username, path)
+    conn = get_conn(path=path)
+    if conn in _archived:
+        return True
+    cold = archive_path(path)
+    if conn.in_transaction or not (create or os.path.exists(cold)):
+        return False
+    conn.execute('ATTACH DATABASE ? AS archive', (cold,))
+    create_archive_schema(conn, 'archive')
+    with _pool_lock:
+        _archived.add(conn)
+    return True
+
+
+def _has_archive(conn):
+    return any(row[1] == 'archive' for row in conn.execute('PRAGMA database_list'))
+
+
+def close_all():
+    global _generation
+    with _pool_lock:
+        conns = list(_open)
+        _open.clear()
+        _idle.clear()
+        _archived.clear()
+        _generation += 1
+    for conn in conns:
+        conn.close()
+
+
+atexit.register(close_all)
+
+
+# ------------------- SCHEMA MIGRATIONS -------------------
+USERSTABLE = (
+    'CREATE TABLE IF NOT EXISTS {name}(username TEXT NOT NULL, salt BLOB NOT NULL, key BLOB NOT NULL, '
+    'iterations INTEGER NOT NULL, created TEXT)'
+)
+USERSTABLE_INDEX = 'CREATE UNIQUE INDEX IF NOT EXISTS idx_userstable_username ON userstable(username)'
+LEGACY_HASH_BATCH = 200
+
+
+def _migrate_users(conn):
+    if 'password' not in {row[1] for row in conn.execute('PRAGMA table_info(userstable)')}:
+        # Created with the hashed schema already (see create_tables)
+        conn.execute(USERSTABLE_INDEX)
+        return
+    # userstable had no key and kept plaintext passwords. Rebuild it with a
+    # unique username; where a username was taken twice the first account
+    # keeps it. Even a cheap hash per user is too long to hold the write lock
+    # for, so passwords are copied as they are (iterations 0) and
+    # _hash_legacy_passwords replaces them right after, in batches. The
+    # dropped table's pages are zeroed, not left on disk.
+    secure_delete = conn.execute('PRAGMA secure_delete').fetchone()[0]
+    conn.execute('PRAGMA secure_delete=ON')
+    conn.execute(USERSTABLE.format(name='userstable_new'))
+    legacy = conn.execute(
+        'SELECT username, password FROM userstable WHERE rowid IN (SELECT MIN(rowid) FROM userstable GROUP BY username)'
+    )
+    for username, password in legacy:
+        if username is None:
+            continue
+        conn.execute(
+            'INSERT INTO userstable_new(username, salt, key, iterations) VALUES (?, ?, ?, 0)',
+            (username, os.urandom(SALT_BYTES), (password or '').encode('utf-8')),
+        )
+    conn.execute('DROP TABLE userstable')
+    conn.execute('ALTER TABLE userstable_new RENAME TO userstable')
+    conn.execute(USERSTABLE_INDEX)
+    conn.execute(f'PRAGMA secure_delete={secure_delete}')
+
+
+def _hash_legacy_passwords(conn):
+    # Swaps each plaintext password left by migration 4 for a cheap salted key
+    # (MIGRATION_ITERATIONS); login_user raises it to the full count. Keys are
+    # computed outside any transaction and written LEGACY_HASH_BATCH at a
+    # time, so the write lock is only held for the UPDATEs. Another process
+    # doing the same is harmless: only rows still at iterations 0 are updated.
+    secure_delete = conn.execute('PRAGMA secure_delete').fetchone()[0]
+    conn.execute('PRAGMA secure_delete=ON')
+    try:
+        while True:
+            rows = conn.execute(
+                'SELECT rowid, salt, key FROM userstable WHERE iterations = 0 LIMIT ?', (LEGACY_HASH_BATCH,)
+            ).fetchall()
+            if not rows:
+                break
+            keys = [
+                (hash_password(password.decode('utf-8'), salt, MIGRATION_ITERATIONS)[1], MIGRATION_ITERATIONS, rowid)
+                for rowid, salt, password in rows
+            ]
+            with conn:
+                conn.executemany('UPDATE userstable SET key = ?, iterations = ? WHERE rowid = ? AND iterations = 0', keys)
+    finally:
+        conn.execute(f'PRAGMA secure_delete={secure_delete}')
+
+
+# Applied in order on top of the base tables; PRAGMA user_version records how
+# many have run. Each step is an SQL string or a function taking the connection.
+MIGRATIONS = [
+    # 1: chat history lookups by user, newest first
+    ('CREATE INDEX IF NOT EXISTS idx_chat_history_user_ts ON chat_history(username, timestamp)',),
+    # 2: per-user daily rollups of mood_logs and phq9_results (see ROLLUPS)
+    (
+        'CREATE TABLE IF NOT EXISTS mood_daily(username TEXT NOT NULL, day TEXT NOT NULL, mood TEXT NOT NULL, '
+        'entries INTEGER NOT NULL, PRIMARY KEY (username, day, mood)) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS phq9_daily(username TEXT NOT NULL, day TEXT NOT NULL, entries INTEGER NOT NULL, '
+        'score_sum INTEGER NOT NULL, score_min INTEGER NOT NULL, score_max INTEGER NOT NULL, '
+        'last_score INTEGER NOT NULL, last_level TEXT, last_at TEXT NOT NULL, PRIMARY KEY (username, day)) WITHOUT ROWID',
+        lambda conn: rebuild_rollups(conn),
+    ),
+    # 3: full-text indexes over chat messages/responses and mood notes (see
+    # SEARCH). External-content tables: the text lives only in the base
+    # tables and the triggers keep the index in step with them.
+    (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5(username, message, response, "
+        "content='chat_history', content_rowid='rowid', tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')",
+        'CREATE TRIGGER IF NOT EXISTS chat_fts_insert AFTER INSERT ON chat_history BEGIN '
+        'INSERT INTO chat_fts(rowid, username, message, response) VALUES (new.rowid, new.username, new.message, new.response); END',
+        'CREATE TRIGGER IF NOT EXISTS chat_fts_delete AFTER DELETE ON chat_history BEGIN '
+        "INSERT INTO chat_fts(chat_fts, rowid, username, message, response) VALUES ('delete', old.rowid, old.username, old.message, old.response); END",
+        'CREATE TRIGGER IF NOT EXISTS chat_fts_update AFTER UPDATE ON chat_history BEGIN '
+        "INSERT INTO chat_fts(chat_fts, rowid, username, message, response) VALUES ('delete', old.rowid, old.username, old.message, old.response); "
+        'INSERT INTO chat_fts(rowid, username, message, response) VALUES (new.rowid, new.username, new.message, new.response); END',
+        "INSERT INTO chat_fts(chat_fts) VALUES ('rebuild')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS mood_fts USING fts5(username, note, "
+        "content='mood_logs', content_rowid='rowid', tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')",
+        'CREATE TRIGGER IF NOT EXISTS mood_fts_insert AFTER INSERT ON mood_logs BEGIN '
+        'INSERT INTO mood_fts(rowid, username, note) VALUES (new.rowid, new.username, new.note); END',
+        'CREATE TRIGGER IF NOT EXISTS mood_fts_delete AFTER DELETE ON mood_logs BEGIN '
+        "INSERT INTO mood_fts(mood_fts, rowid, username, note) VALUES ('delete', old.rowid, old.username, old.note); END",
+        'CREATE TRIGGER IF NOT EXISTS mood_fts_update AFTER UPDATE ON mood_logs BEGIN '
+        "INSERT INTO mood_fts(mood_fts, rowid, username, note) VALUES ('delete', old.rowid, old.username, old.note); "
+        'INSERT INTO mood_fts(rowid, username, note) VALUES (new.rowid, new.username, new.note); END',
+        "INSERT INTO mood_fts(mood_fts) VALUES ('rebuild')",
+    ),
+    # 4: unique usernames, salted password keys
+    (_migrate_users,),
+]
+
+
+def _migrate(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    while version < len(MIGRATIONS):
+        # IMMEDIATE takes the write lock up front, so two processes starting
+        # together can't run the same migration twice
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version < len(MIGRATIONS):
+                for step in MIGRATIONS[version]:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                version += 1
+                conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
 
+# ------------------- QUERIES -------------------
+def create_tables(path):
+    with get_conn(path=path) as conn:
+        conn.execute(USERSTABLE.format(name='userstable'))
+        conn.execute('CREATE TABLE IF NOT EXISTS mood_logs(username TEXT, mood TEXT, note TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)')
+        conn.execute('CREATE TABLE IF NOT EXISTS phq9_results(username TEXT, score INTEGER, level TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)')
+        conn.execute('CREATE TABLE IF NOT EXISTS chat_history(username TEXT, message TEXT, response TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)')
+    _migrate(get_conn(path=path))
+    _hash_legacy_passwords(get_conn(path=path))
+
+
+@timed('db.create_usertable')
 def create_usertable():
-    c.execute('CREATE TABLE IF NOT EXISTS userstable(username TEXT, password TEXT)')
-    c.execute('CREATE TABLE IF NOT EXISTS mood_logs(username TEXT, mood TEXT, note TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)')
-    c.execute('CREATE TABLE IF NOT EXISTS phq9_results(username TEXT, score INTEGER, level TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)')
-    c.execute('CREATE TABLE IF NOT EXISTS chat_history(username TEXT, message TEXT, response TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)')
-    conn.commit()
+    # Every shard carries the full schema
+    for_each_shard(create_tables)
 
+@timed('db.add_user')
 def add_user(username, password):
-    c.execute('INSERT INTO userstable(username,password) VALUES (?,?)', (username, password))
-    conn.commit()
+    # False if the username is already taken
+    salt, key, iterations = hash_password(password)
+    try:
+        with get_conn(username) as conn:
+            conn.execute(
+                'INSERT INTO userstable(username, salt, key, iterations, created) VALUES (?, ?, ?, ?, ?)',
+                (username, salt, key, iterations, _now()),
+            )
+    except sqlite3.IntegrityError:
+        return False
+    return True
 
+# Unknown usernames are checked against this, see login_user
+_DUMMY_SALT = os.urandom(SALT_BYTES)
+
+@timed('db.login_user')
 def login_user(username, password):
-    c.execute('SELECT * FROM userstable WHERE username = ? AND password = ?', (username, password))
-    return c.fetchone()
+    # Returns the username on success, None otherwise
+    row = get_conn(username).execute(
+        'SELECT salt, key, iterations FROM userstable WHERE username = ?', (username,)
+    ).fetchone()
+    if row is None:
+        # Hash anyway, so an unknown username takes as long as a wrong password
+        verify_password(password, _DUMMY_SALT, b'', PASSWORD_ITERATIONS)
+        return None
+    if not verify_password(password, *row):
+        return None
+    if row[2] < PASSWORD_ITERATIONS:
+        # A migrated legacy key or an older, cheaper setting; upgrade while we have the password
+        with get_conn(username) as conn:
+            conn.execute(
+                'UPDATE userstable SET salt = ?, key = ?, iterations = ? WHERE username = ?',
+                (*hash_password(password), username),
+            )
+    return username
+
+@timed('db.user_exists')
+def user_exists(username):
+    return get_conn(username).execute('SELECT 1 FROM userstable WHERE username = ?', (username,)).fetchone() is not None
 
+@timed('db.save_mood')
 def save_mood(username, mood, note):
-    c.execute('INSERT INTO mood_logs(username, mood, note) VALUES (?, ?, ?)', (username, mood, note))
-    conn.commit()
+    _save('mood_logs', (username, mood, note, _now()))
 
+@timed('db.save_phq9')
 def save_phq9(username, score, level):
-    c.execute('INSERT INTO phq9_results(username, score, level) VALUES (?, ?, ?)', (username, score, level))
-    conn.commit()
+    _save('phq9_results', (username, score, level, _now()))
 
+@timed('db.save_chat')
 def save_chat(username, message, response):
-    c.execute('INSERT INTO chat_history(username, message, response) VALUES (?, ?, ?)', (username, message, response))
-    conn.commit()
+    _save('chat_history', (username, message, response, _now()))
+
+# Keyset pagination over a user's chat history, newest first. Pass the cursor
+# returned with one page to get the next; it is None after the last page.
+CHAT_PAGE_SIZE = 20
+
+@timed('db.get_chat_page')
+def get_chat_page(username, cursor=None, limit=CHAT_PAGE_SIZE):
+    wait_for_user_writes(username)
+    conn = get_conn(username)
+    if cursor is None:
+        rows = conn.execute(
+            'SELECT rowid, message, response, timestamp FROM main.chat_history WHERE username = ? '
+            'ORDER BY timestamp DESC, rowid DESC LIMIT ?',
+            (username, limit + 1),
+        ).fetchall()
+    else:
+        timestamp, rowid = cursor
+        rows = conn.execute(
+            'SELECT rowid, message, response, timestamp FROM main.chat_history WHERE username = ? '
+            'AND (timestamp, rowid) < (?, ?) ORDER BY timestamp DESC, rowid DESC LIMIT ?',
+            (username, timestamp, rowid, limit + 1),
+        ).fetchall()
+
+    if attach_archive(username):
+        # Archived rows share the (timestamp, rowid) keys, so the same cursor
+        # pages through both tiers; a row caught mid-move shows up once
+        if cursor is None:
+            archived = conn.execute(
+                'SELECT id, message, response, timestamp FROM archive.chat_history WHERE username = ? '
+                'ORDER BY timestamp DESC, id DESC LIMIT ?',
+                (username, limit + 1),
+            ).fetchall()
+        else:
+            archived = conn.execute(
+                'SELECT id, message, response, timestamp FROM archive.chat_history WHERE username = ? '
+                'AND (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT ?',
+                (username, timestamp, rowid, limit + 1),
+            ).fetchall()
+        if archived:
+            merged = {(row[3], row[0]): row for row in archived + rows}
+            rows = sorted(merged.values(), key=lambda row: (row[3], row[0]), reverse=True)[:limit + 1]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1][3], rows[-1][0])
+    return [(unpack(message), unpack(response), timestamp) for _, message, response, timestamp in rows], next_cursor
+
+
+# ------------------- SEARCH -------------------
+# Ranked full-text search over the FTS5 indexes from migration 3. Terms are
+# stemmed (porter), so "sleeping" finds "sleep"; a trailing * matches a
+# prefix. The username column narrows the match inside the index and the
+# join re-checks it exactly. Matches are wrapped in HIGHLIGHT, so they render
+# bold in markdown. Archived matches are listed after the hot tier's.
+SEARCH_PAGE_SIZE = 10
+HIGHLIGHT = ('**', '**')
+# bm25 costs a few microseconds per matching row, so ranking all of a user's
+# 100k+ chats that mention "sleep" takes ~0.4s. Matches are ranked in windows
+# of RANK_WINDOW, newest window first; paging past the end of one window
+# carries on into the next, so older matches are still reached, ranked among
+# their own window.
+RANK_WINDOW = 1000
+_MAX_ROWID = 2 ** 63 - 1
+_MIN_ROWID = -2 ** 63
+
+
+def _fts_string(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def fts_query(text, columns):
+    # User text as quoted terms, so no FTS syntax gets through
+    terms = []
+    for term in text.split():
+        prefix = term.endswith('*')
+        term = term.rstrip('*')
+        if term:
+            terms.append(_fts_string(term) + ('*' if prefix else ''))
+    if not terms:
+        return None
+    return f'{columns} : ({" ".join(terms)})'
+
+
+def _windows(conn, table, match):
+    # (lowest, highest + 1) rowids of each window of matches, newest first
+    upper = _MAX_ROWID
+    while True:
+        oldest = conn.execute(
+            f'SELECT rowid FROM {table} WHERE {table.split(".")[-1]} MATCH ? AND rowid < ? '
+            'ORDER BY rowid DESC LIMIT 1 OFFSET ?',
+            (match, upper, RANK_WINDOW - 1),
+        ).fetchone()
+        if oldest is None:
+            yield _MIN_ROWID, upper
+            return
+        yield oldest[0], upper
+        upper = oldest[0]
+
+
+def _search(fts, tiers, columns, rank, username, match, page, limit):
+    # tiers: [(schema, join)], hot first, each walked window by window. A
+    # page that runs past one window carries on into the next; windows it
+    # skips whole are only counted, not ranked.
+    wait_for_user_writes(username)
+    archived = attach_archive(username)
+    conn = get_conn(username)
+    match = f'username : {_fts_string(username)} AND {match}'
+    skip, rows = page * limit, []
+    for schema, join in tiers if archived else tiers[:1]:
+        source = (f'FROM {schema}.{fts} CROSS JOIN {schema}.{join} '
+                  f'WHERE {fts} MATCH ?3 AND c.username = ?4 AND {fts}.rowid >= ?5 AND {fts}.rowid < ?6')
+        for lowest, upper in _windows(conn, f'{schema}.{fts}', match):
+            params = (*HIGHLIGHT, match, username, lowest, upper)
+            found = conn.execute(
+                f'SELECT {columns} {source} ORDER BY {rank} LIMIT ?7 OFFSET ?8', (*params, limit + 1 - len(rows), skip)
+            ).fetchall()
+            if found:
+                rows += found
+                skip = 0
+            else:
+                skip -= min(skip, conn.execute(f'SELECT COUNT(*) {source}', params).fetchone()[0])
+            if len(rows) > limit:
+                return rows[:limit], True
+    return rows, False
+
+
+@timed('db.search_chats')
+def search_chats(username, text, page=0, limit=SEARCH_PAGE_SIZE):
+    # Returns ([(message, response, timestamp)], has_more), best match first
+    match = fts_query(text, '{message response}')
+    if match is None:
+        return [], False
+    # CROSS JOIN keeps the FTS table as the outer loop
+    return _search(
+        'chat_fts',
+        [('main', 'chat_history AS c ON c.rowid = chat_fts.rowid'),
+         ('archive', 'chat_history AS c ON c.id = chat_fts.rowid')],
+        "highlight(chat_fts, 1, ?1, ?2), snippet(chat_fts, 2, ?1, ?2, '…', 48), c.timestamp",
+        'bm25(chat_fts, 0.0, 2.0, 1.0)',
+        username, match, page, limit,
+    )
+
+
+@timed('db.search_notes')
+def search_notes(username, text, page=0, limit=SEARCH_PAGE_SIZE):
+    # Returns ([(note, mood, timestamp)], has_more), best match first
+    match = fts_query(text, 'note')
+    if match is None:
+        return [], False
+    return _search(
+        'mood_fts',
+        [('main', 'mood_logs AS c ON c.rowid = mood_fts.rowid'),
+         ('archive', 'mood_logs AS c ON c.id = mood_fts.rowid')],
+        'highlight(mood_fts, 1, ?1, ?2), c.mood, c.timestamp',
+        'bm25(mood_fts, 0.0, 1.0)',
+        username, match, page, limit,
+    )
+
+
+# ------------------- WRITE-BEHIND -------------------
+# By default each save_* commits on the caller's thread. With write-behind
+# enabled, saves are queued and a background thread commits them in batches,
+# closing a batch once it holds batch_size rows or max_delay seconds passed.
+# Timestamps are taken at enqueue time, so rows keep the time of the click.
+INSERTS = {
+    'mood_logs': 'INSERT INTO mood_logs(username, mood, note, timestamp) VALUES (?, ?, ?, ?)',
+    'phq9_results': 'INSERT INTO phq9_results(username, score, level, timestamp) VALUES (?, ?, ?, ?)',
+    'chat_history': 'INSERT INTO chat_history(username, message, response, timestamp) VALUES (?, ?, ?, ?)',
+}
+
+# Daily rollups are updated in the same transaction as the raw insert, so
+# trend charts read O(days) rows instead of rescanning the logs. Days are UTC,
+# like the timestamps. Parameters are the INSERTS row as-is.
+ROLLUPS = {
+    'mood_logs': (
+        'INSERT INTO mood_daily(username, mood, day, entries) VALUES (?1, ?2, date(?4), 1) '
+        'ON CONFLICT(username, day, mood) DO UPDATE SET entries = entries + 1'
+    ),
+    'phq9_results': (
+        'INSERT INTO phq9_daily(username, day, entries, score_sum, score_min, score_max, last_score, last_level, last_at) '
+        'VALUES (?1, date(?4), 1, ?2, ?2, ?2, ?2, ?3, ?4) '
+        'ON CONFLICT(username, day) DO UPDATE SET entries = entries + 1, score_sum = score_sum + excluded.score_sum, '
+        'score_min = min(score_min, excluded.score_min), score_max = max(score_max, excluded.score_max), '
+        'last_score = CASE WHEN excluded.last_at >= last_at THEN excluded.last_score ELSE last_score END, '
+        'last_level = CASE WHEN excluded.last_at >= last_at THEN excluded.last_level ELSE last_level END, '
+        'last_at = max(last_at, excluded.last_at)'
+    ),
+}
+
+
+@timed('db.rebuild_rollups')
+def rebuild_rollups(conn, username=None):
+    # Set-based rebuild from the raw tables, for the migration and for
+    # backfills after bulk loads; runs inside the caller's transaction
+    where, params = ('WHERE username = ?', (username,)) if username is not None else ('', ())
+    moods = 'mood_logs'
+    if _has_archive(conn):
+        # Archived moods still count, once; attach_archive() before the transaction
+        moods = ('(SELECT username, mood, timestamp FROM main.mood_logs '
+                 'UNION ALL SELECT a.username, a.mood, a.timestamp FROM archive.mood_logs AS a '
+                 f'WHERE {ARCHIVE_ONLY.format(table="mood_logs")})')
+    conn.execute(f'DELETE FROM mood_daily {where}', params)
+    conn.execute(f'DELETE FROM phq9_daily {where}', params)
+    conn.execute(
+        'INSERT INTO mood_daily(username, day, mood, entries) '
+        f'SELECT username, date(timestamp), mood, COUNT(*) FROM {moods} {where} GROUP BY 1, 2, 3',
+        params,
+    )
+    conn.execute(
+        'INSERT INTO phq9_daily(username, day, entries, score_sum, score_min, score_max, last_score, last_level, last_at) '
+        'SELECT username, day, COUNT(*), SUM(score), MIN(score), MAX(score), '
+        'MAX(CASE WHEN rn = 1 THEN score END), MAX(CASE WHEN rn = 1 THEN level END), MAX(timestamp) '
+        'FROM (SELECT username, date(timestamp) AS day, score, level, timestamp, ROW_NUMBER() OVER '
+        f'(PARTITION BY username, date(timestamp) ORDER BY timestamp DESC, rowid DESC) AS rn FROM phq9_results {where}) '
+        'GROUP BY username, day',
+        params,
+    )
+
+
+_writer = None
+
+
+def _now():
+    # Same format as SQLite's CURRENT_TIMESTAMP (UTC)
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _write_rows(conn, table, rows):
+    conn.executemany(INSERTS[table], rows)
+    if table in ROLLUPS:
+        conn.executemany(ROLLUPS[table], rows)
+
+
+def _save(table, row):
+    if _writer is not None:
+        _writer.put(table, row)
+    else:
+        with get_conn(row[0]) as conn:
+            _write_rows(conn, table, [row])
+
+
+class WriteBehindQueue:
+    _STOP = object()
+
+    def __init__(self, max_size=10000, batch_size=200, max_delay=0.05, put_timeout=1.0, retries=3):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self._queue = queue.Queue(max_size)
+        self._pending = Counter()
+        self._pending_cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='mindmate-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, table, row):
+        username = row[0]
+        with self._pending_cond:
+            self._pending[username] += 1
+        try:
+            # A full queue blocks the caller for a while (backpressure); if the
+            # writer still hasn't caught up, write this row directly
+            self._queue.put((table, row), timeout=self.put_timeout)
+        except queue.Full:
+            self._done([username])
+            with get_conn(username) as conn:
+                _write_rows(conn, table, [row])
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        # One transaction per shard the batch touches
+        by_shard = {}
+        for table, row in batch:
+            by_shard.setdefault(shard_for(row[0]), {}).setdefault(table, []).append(row)
+
+        try:
+            for path, by_table in by_shard.items():
+                self._commit_shard(path, by_table)
+        finally:
+            self._done([row[0] for _, row in batch])
+
+    def _commit_shard(self, path, by_table):
+        for attempt in range(1, self.retries + 1):
+            try:
+                with span('db.write_behind_batch'), get_conn(path=path) as conn:
+                    for table, rows in by_table.items():
+                        _write_rows(conn, table, rows)
+                return
+            except sqlite3.Error:
+                if attempt == self.retries:
+                    logger.exception('Write-behind batch of %d rows for %s failed; dropping it',
+                                     sum(map(len, by_table.values())), path)
+                else:
+                    time.sleep(0.1 * attempt)
+
+    def _done(self, usernames):
+        with self._pending_cond:
+            self._pending.subtract(usernames)
+            for username in set(usernames):
+                if self._pending[username] <= 0:
+                    del self._pending[username]
+            self._pending_cond.notify_all()
+
+    def wait_for(self, username=None, timeout=5.0):
+        # Read-your-writes: block until the user's queued rows are committed
+        def settled():
+            if username is None:
+                return not self._pending
+            return username not in self._pending
+
+        with self._pending_cond:
+            return self._pending_cond.wait_for(settled, timeout)
+
+    def _drain(self):
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items
+            if item is not self._STOP:
+                items.append(item)
+
+    def stop(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            # The writer is stuck or far behind; commit the backlog here, then
+            # queue the stop behind whatever it is still working on
+            backlog = self._drain()
+            if backlog:
+                self._commit(backlog)
+            try:
+                self._queue.put_nowait(self._STOP)
+            except queue.Full:
+                pass
+        self._thread.join(max(deadline - time.monotonic(), 0))
+        # Rows queued by callers that raced with stop()
+        leftovers = self._drain()
+        if leftovers:
+            self._commit(leftovers)
+
+
+def enable_write_behind(**options):
+    global _writer
+    if _writer is None:
+        _writer = WriteBehindQueue(**options)
+        atexit.register(disable_write_behind)
+    return _writer
+
+
+def disable_write_behind():
+    # Flushes everything queued so far, then goes back to synchronous saves
+    global _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop()
+
+
+@timed('db.wait_for_user_writes')
+def wait_for_user_writes(username, timeout=5.0):
+    if _writer is not None:
+        _writer.wait_for(username, timeout)
+
+
+if os.environ.get('MINDMATE_WRITE_BEHIND') == '1':
+    enable_write_behind()
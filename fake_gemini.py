@@ -0,0 +1,137 @@
+import random
+import threading
+import time
+
+# Local stand-in for google.generativeai.GenerativeModel, for development,
+# benchmarks and trying the streaming chat without an API key. It mirrors the
+# parts of the real API the app uses: generate_content, start_chat,
+# ChatSession.send_message(stream=...), history and rewind().
+#
+#   latency       seconds before the first chunk (or the whole reply)
+#   chunk_delay   seconds between streamed chunks
+#   chunk_size    words per chunk
+#   error_rate    probability that a call raises FakeGeminiError up front
+#   fail_after    raise mid-stream after this many chunks (None: never)
+
+TASKS = [
+    "Take a slow, deep breath and count to five.",
+    "Stretch your arms above your head for ten seconds.",
+    "Write down one thing that went well today.",
+    "Drink a glass of water.",
+    "Step outside for two minutes of fresh air.",
+    "Send a kind message to a friend.",
+    "Tidy one small corner of your room.",
+]
+
+
+class FakeGeminiError(RuntimeError):
+    pass
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    def __init__(self, text, model, stream):
+        self._text = text
+        self._model = model
+        self._stream = stream
+        self._done = not stream
+        self._callbacks = []
+
+    @property
+    def text(self):
+        if not self._done:
+            raise ValueError("Iterate over the streamed response before reading .text")
+        return self._text
+
+    def __iter__(self):
+        if not self._stream:
+            yield FakeChunk(self._text)
+            return
+        words = self._text.split(" ")
+        for count, start in enumerate(range(0, len(words), self._model.chunk_size)):
+            if self._model.fail_after is not None and count >= self._model.fail_after:
+                raise FakeGeminiError("Stream interrupted")
+            if count:
+                time.sleep(self._model.chunk_delay)
+            chunk = " ".join(words[start:start + self._model.chunk_size])
+            yield FakeChunk(chunk if start == 0 else " " + chunk)
+        self._done = True
+        for callback in self._callbacks:
+            callback()
+
+
+class FakeChatSession:
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+        self._pending = None
+
+    def send_message(self, content, stream=False):
+        self._pending = None
+        response = self.model.respond(self.model.chat_reply(content), stream)
+        turn = [{"role": "user", "parts": [content]}, {"role": "model", "parts": [response._text]}]
+        if stream:
+            self._pending = response
+            response._callbacks.append(lambda: self._commit(response, turn))
+        else:
+            self.history.extend(turn)
+        return response
+
+    def _commit(self, response, turn):
+        if self._pending is response:
+            self.history.extend(turn)
+            self._pending = None
+
+    def rewind(self):
+        if self._pending is not None:
+            self._pending = None
+        elif len(self.history) >= 2:
+            del self.history[-2:]
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name="fake-gemini", latency=0.0, chunk_delay=0.0, chunk_size=3,
+                 error_rate=0.0, fail_after=None, seed=None):
+        self.model_name = model_name
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.error_rate = error_rate
+        self.fail_after = fail_after
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.calls = 0
+
+    def _roll(self):
+        with self._random_lock:
+            self.calls += 1
+            return self._random.random()
+
+    def chat_reply(self, message):
+        return (
+            f"Thanks for sharing that. You said: \"{message}\". "
+            "It sounds like a lot is on your mind, and it's okay to take things one step at a time. "
+            "Would you like to tell me more about how you're feeling?"
+        )
+
+    def tasks_reply(self):
+        with self._random_lock:
+            tasks = self._random.sample(TASKS, 5)
+        return "\n".join(f"{n}. {task}" for n, task in enumerate(tasks, 1))
+
+    def respond(self, text, stream=False):
+        failed = self._roll() < self.error_rate
+        time.sleep(self.latency)
+        if failed:
+            raise FakeGeminiError("Simulated upstream error")
+        return FakeResponse(text, self, stream)
+
+    def generate_content(self, contents, stream=False):
+        return self.respond(self.tasks_reply(), stream)
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history)
@@ -0,0 +1,305 @@
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import metrics
+from shared_cache import cache_key
+
+logger = logging.getLogger("mindmate")
+
+# Guard around the Gemini model. GeminiClient offers the same generate_content
+# and start_chat(...).send_message(...) calls the app already makes, with:
+#   - a deadline on every call (and on every gap between streamed chunks),
+#   - a circuit breaker that fails fast while the upstream is unhealthy,
+#   - single-flight: identical generate_content prompts in flight at the same
+#     time share one upstream call,
+#   - a cap on concurrent upstream calls,
+#   - with a shared_cache.SharedCache, generate_content calls that opt in with
+#     a shared= tag (suggestion pools) are shared across worker processes.
+#     Anything about one user, chat replies and summaries, never is.
+# Every failure surfaces as GeminiUnavailable, so callers have one thing to
+# catch before falling back to fallback_tasks or a canned reply.
+
+
+class GeminiUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive failures. After reset_after
+    # seconds one trial call is let through (half-open); its outcome closes
+    # the breaker or opens it again.
+
+    def __init__(self, failure_threshold=5, reset_after=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_after:
+                self.state = "half_open"
+                return True
+            return False
+
+    def rejecting(self):
+        # Whether allow() would refuse now, without using up the half-open trial
+        with self._lock:
+            if self.state == "open":
+                return time.monotonic() - self._opened_at < self.reset_after
+            return self.state == "half_open"
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = "closed"
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning("Gemini circuit opened after %d failures", self.failures)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class CachedResponse:
+    # Stands in for a response served from the cache
+    def __init__(self, text):
+        self.text = text
+
+
+class GeminiClient:
+    def __init__(self, model, timeout=15.0, chunk_timeout=10.0, stream_timeout=60.0,
+                 max_concurrency=8, queue_timeout=2.0, breaker=None, cache=None, model_name=None):
+        self.model = model
+        self.cache = cache
+        self.model_name = model_name or getattr(model, "model_name", "gemini")
+        self.timeout = timeout
+        self.chunk_timeout = chunk_timeout
+        self.stream_timeout = stream_timeout
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_concurrency, thread_name_prefix="mindmate-gemini")
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def _admit(self):
+        if not self.breaker.allow():
+            metrics.incr("gemini.rejected")
+            raise GeminiUnavailable("Gemini is unavailable right now")
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            metrics.incr("gemini.saturated")
+            raise GeminiUnavailable("Too many Gemini calls in flight")
+        metrics.incr("gemini.calls")
+
+    def _submit(self, fn, *args):
+        # The slot is held until the upstream call really ends, even when the
+        # caller stopped waiting, so the cap reflects actual upstream load
+        def run():
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+
+        try:
+            # Run in the caller's context so spans keep their session/tab tags
+            return self._executor.submit(contextvars.copy_context().run, run)
+        except RuntimeError as e:
+            # The executor is shut down once the interpreter starts exiting
+            self._slots.release()
+            raise GeminiUnavailable(str(e)) from e
+
+    def _call(self, fn, *args, name="gemini.call", timeout=None):
+        self._admit()
+        future = self._submit(fn, *args)
+        try:
+            with metrics.span(name):
+                result = future.result(timeout or self.timeout)
+        except FutureTimeoutError:
+            metrics.incr("gemini.timeouts")
+            self.breaker.record_failure()
+            raise GeminiUnavailable(f"Gemini did not answer within {self.timeout:g}s") from None
+        except Exception as e:
+            metrics.incr("gemini.errors")
+            self.breaker.record_failure()
+            raise GeminiUnavailable(str(e)) from e
+        self.breaker.record_success()
+        return result
+
+    def generate_content(self, prompt, shared=None):
+        # With shared (e.g. a suggestion pool slot), the answer is read from
+        # and written to the shared cache, keyed by the prompt and that tag.
+        # Never pass it for prompts carrying a user's own words.
+        flight = (prompt, shared)
+        with self._inflight_lock:
+            future = self._inflight.get(flight)
+            if future is None:
+                future = self._inflight[flight] = Future()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            metrics.incr("gemini.coalesced")
+            try:
+                return future.result(self.timeout)
+            except FutureTimeoutError:
+                raise GeminiUnavailable(f"Gemini did not answer within {self.timeout:g}s") from None
+
+        try:
+            response = self._generate(prompt, shared)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(flight, None)
+
+    def _generate(self, prompt, shared=None):
+        if self.cache is None or shared is None:
+            return self._call(self.model.generate_content, prompt, name="gemini.generate_content")
+        # Other processes asking for the same prompt wait on this call. Waiting
+        # on another process and then calling ourselves share one timeout.
+        deadline = time.monotonic() + self.timeout
+
+        def fail_fast():
+            if self.breaker.rejecting():
+                metrics.incr("gemini.rejected")
+                raise GeminiUnavailable("Gemini is unavailable right now")
+
+        def compute():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                metrics.incr("gemini.timeouts")
+                raise GeminiUnavailable(f"Gemini did not answer within {self.timeout:g}s")
+            return self._call(self.model.generate_content, prompt, name="gemini.generate_content",
+                              timeout=remaining).text
+
+        text = self.cache.get_or_compute(
+            cache_key(self.model_name, f"{prompt}\0{shared}"), compute, wait=self.timeout, admit=fail_fast,
+        )
+        return CachedResponse(text)
+
+    def start_chat(self, history=None):
+        return GuardedChat(self, self.model.start_chat(history=history or []))
+
+
+class _StreamCall:
+    def __init__(self):
+        self.chunks = queue.Queue()
+        self.finished = False
+        self.completed = False
+        self.abandoned = False
+
+
+class GuardedChat:
+    # Wraps a chat session so send_message goes through the client's guards.
+    # Streamed chunks are pulled on a worker thread and handed over through a
+    # queue, which is what lets the caller give up on a stalled stream.
+
+    def __init__(self, client, chat):
+        self.client = client
+        self.chat = chat
+        self._call = None
+        self._lock = threading.Lock()
+
+    @property
+    def history(self):
+        return self.chat.history
+
+    def send_message(self, content, stream=False):
+        with self._lock:
+            if self._call is not None and not self._call.finished:
+                raise GeminiUnavailable("The previous reply is still in progress")
+        if not stream:
+            return self.client._call(self.chat.send_message, content, name="gemini.send_message")
+
+        self.client._admit()
+        call = _StreamCall()
+        self.client._submit(self._pump, call, content)
+        # Only once the pump is running: a call that never started would
+        # never finish and would block every later message
+        with self._lock:
+            self._call = call
+        return self._receive(call)
+
+    def _pump(self, call, content):
+        response = None
+        failed = False
+        try:
+            response = self.chat.send_message(content, stream=True)
+            for chunk in response:
+                if call.abandoned:
+                    break
+                call.chunks.put(("chunk", chunk))
+            call.chunks.put(("done", None))
+        except Exception as e:
+            failed = True
+            call.chunks.put(("error", e))
+        finally:
+            with self._lock:
+                call.finished = True
+                abandoned = call.abandoned
+                call.completed = not (failed or abandoned)
+            if not call.completed and response is not None:
+                self.chat.rewind()
+
+    def _receive(self, call):
+        with metrics.span("gemini.stream"):
+            yield from self._receive_chunks(call)
+
+    def _receive_chunks(self, call):
+        breaker = self.client.breaker
+        deadline = time.monotonic() + self.client.stream_timeout
+        first = True
+        while True:
+            wait = self.client.timeout if first else self.client.chunk_timeout
+            wait = min(wait, deadline - time.monotonic())
+            try:
+                kind, value = call.chunks.get(timeout=max(wait, 0))
+            except queue.Empty:
+                metrics.incr("gemini.timeouts")
+                breaker.record_failure()
+                raise GeminiUnavailable("Gemini stopped responding") from None
+
+            if kind == "chunk":
+                if first:
+                    breaker.record_success()
+                    first = False
+                yield value
+            elif kind == "done":
+                breaker.record_success()
+                return
+            else:
+                metrics.incr("gemini.errors")
+                breaker.record_failure()
+                raise GeminiUnavailable(str(value)) from value
+
+    def rewind(self):
+        # A stream still running is told to stop and rewinds its own turn when
+        # done; until then it stays the current call, so send_message refuses
+        # to start a second stream on the same session. One that failed has
+        # already rewound.
+        with self._lock:
+            call = self._call
+            if call is not None and not call.finished:
+                call.abandoned = True
+                return
+            self._call = None
+            if call is not None and not call.completed:
+                return
+        self.chat.rewind()
@@ -0,0 +1,273 @@
+import contextvars
+import cProfile
+import functools
+import io
+import itertools
+import logging
+import os
+import pstats
+import random
+import statistics
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("mindmate")
+
+# In-process counters and timing samples. Samples are kept in bounded
+# deques, so memory stays flat however long the process runs.
+MAX_SAMPLES = 1000
+SPAN_BUFFER = 5000
+
+_lock = threading.Lock()
+_counters = Counter()
+_samples = {}
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def observe(name, value):
+    with _lock:
+        samples = _samples.get(name)
+        if samples is None:
+            samples = _samples[name] = deque(maxlen=MAX_SAMPLES)
+        samples.append(value)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summary(name):
+    with _lock:
+        values = list(_samples.get(name, ()))
+    return {
+        "count": len(values),
+        "p50": statistics.median(values) if values else 0.0,
+        "p95": percentile(values, 95),
+        "max": max(values) if values else 0.0,
+    }
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        names = list(_samples)
+    return {"counters": counters, "timings": {name: summary(name) for name in names}}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _samples.clear()
+
+
+# ------------------- SPANS -------------------
+# span()/timed() time a block or function. Each span is recorded as a timing
+# sample plus a call (and error) counter, and kept with its session and tab
+# tags in a ring buffer of the most recent spans for drill-down.
+_session = contextvars.ContextVar("mindmate_session", default=None)
+_tab = contextvars.ContextVar("mindmate_tab", default=None)
+_spans = deque(maxlen=SPAN_BUFFER)
+
+
+def set_context(session=None, tab=None):
+    _session.set(session)
+    _tab.set(tab)
+
+
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        incr(f"{name}.errors")
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        observe(name, elapsed)
+        incr(f"{name}.calls")
+        _spans.append((time.time(), name, elapsed, ok, _session.get(), _tab.get()))
+
+
+def timed(name):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def recent_spans(session=None, tab=None, limit=100):
+    # Newest first: (wall time, name, seconds, ok, session, tab)
+    matches = []
+    for record in reversed(list(_spans)):
+        if session is not None and record[4] != session:
+            continue
+        if tab is not None and record[5] != tab:
+            continue
+        matches.append(record)
+        if len(matches) == limit:
+            break
+    return matches
+
+
+# ------------------- EXPORT -------------------
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text():
+    with _lock:
+        counters = dict(_counters)
+        samples = {name: list(values) for name, values in _samples.items()}
+
+    lines = [
+        "# HELP mindmate_events_total Events counted by the app since start.",
+        "# TYPE mindmate_events_total counter",
+    ]
+    for name, value in sorted(counters.items()):
+        lines.append(f'mindmate_events_total{{name="{_label(name)}"}} {value}')
+
+    lines += [
+        f"# HELP mindmate_seconds Durations over the last {MAX_SAMPLES} samples of each timing.",
+        "# TYPE mindmate_seconds summary",
+    ]
+    for name, values in sorted(samples.items()):
+        for q in (50, 95, 99):
+            lines.append(f'mindmate_seconds{{name="{_label(name)}",quantile="{q / 100}"}} {percentile(values, q):.6f}')
+        lines.append(f'mindmate_seconds_sum{{name="{_label(name)}"}} {sum(values):.6f}')
+        lines.append(f'mindmate_seconds_count{{name="{_label(name)}"}} {len(values)}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_server(port, host="127.0.0.1"):
+    # Serves GET /metrics in Prometheus text format; once per process
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="mindmate-metrics", daemon=True).start()
+            logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return _server
+
+
+def log_summary():
+    data = snapshot()
+    busiest = sorted(data["timings"].items(), key=lambda item: item[1]["count"] * item[1]["p50"], reverse=True)
+    for name, row in busiest[:15]:
+        logger.info(
+            "%-28s n=%-6d p50=%.1fms p95=%.1fms max=%.1fms",
+            name, row["count"], row["p50"] * 1000, row["p95"] * 1000, row["max"] * 1000,
+        )
+
+
+_logger_thread = None
+
+
+def start_log_summary(interval):
+    global _logger_thread
+    with _server_lock:
+        if _logger_thread is None:
+            def loop():
+                while True:
+                    time.sleep(interval)
+                    log_summary()
+
+            _logger_thread = threading.Thread(target=loop, name="mindmate-metrics-log", daemon=True)
+            _logger_thread.start()
+
+
+def start_from_env():
+    # MINDMATE_METRICS_PORT: serve /metrics on that local port
+    # MINDMATE_METRICS_LOG_INTERVAL: log a summary every N seconds
+    port = os.environ.get("MINDMATE_METRICS_PORT")
+    if port:
+        try:
+            start_server(int(port))
+        except OSError as e:
+            # Another worker on this machine already owns the port
+            logger.warning("Metrics server not started on port %s: %s", port, e)
+    interval = os.environ.get("MINDMATE_METRICS_LOG_INTERVAL")
+    if interval:
+        start_log_summary(float(interval))
+
+
+# ------------------- PROFILING -------------------
+# MINDMATE_PROFILE_RATE (0..1) profiles that fraction of reruns with
+# cProfile; force=True profiles one regardless. Stats are written to
+# PROFILE_DIR and the top functions are logged. A block nested in one
+# already being profiled is not profiled again. MINDMATE_PROFILE_URL=1 lets
+# the app force a profile from the ?profile=1 query parameter; leave it off
+# where anyone can reach the app.
+PROFILE_DIR = "profiles"
+_profile_ids = itertools.count(1)
+_profiling = contextvars.ContextVar("mindmate_profiling", default=False)
+
+
+def profile_url_allowed():
+    return os.environ.get("MINDMATE_PROFILE_URL") == "1"
+
+
+def profile_rate():
+    try:
+        return float(os.environ.get("MINDMATE_PROFILE_RATE", "0"))
+    except ValueError:
+        return 0.0
+
+
+@contextmanager
+def maybe_profile(label, force=False):
+    if _profiling.get() or (not force and random.random() >= profile_rate()):
+        yield None
+        return
+
+    profiler = cProfile.Profile()
+    token = _profiling.set(True)
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        _profiling.reset(token)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_profile_ids)}.prof")
+        profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(15)
+        logger.info("Profiled %s, saved to %s\n%s", label, path, out.getvalue())
+        incr("profiles.saved")
@@ -1,47 +1,150 @@
-import pandas as pd
-from sklearn.model_selection import train_test_split
+import argparse
+import io
+import json
+import os
+import statistics
+import time
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+import sklearn
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report
-import numpy as np
+from sklearn.model_selection import train_test_split
+from sklearn.tree import DecisionTreeClassifier
 
-# Generate synthetic PHQ-9 responses for 1000 samples
-np.random.seed(42)
-data = np.random.randint(0, 4, (1000, 9))
-df = pd.DataFrame(data, columns=[f"Q{i}" for i in range(1, 10)])
+from phq9 import NUM_OPTIONS, NUM_QUESTIONS, ScoreThresholdModel, levels_for_scores, sha256_file
 
-# Add total score
-df['total_score'] = df.sum(axis=1)
+# Trains the PHQ-9 severity model on synthetic answers and writes it with a
+# metadata file (version, checksum, metrics) next to it. build_phq9_table.py
+# checks that metadata before turning the model into the app's lookup table.
+#
+#   python model.py                       compare all candidates, keep the best
+#   python model.py --model forest        train and keep one candidate
+#   python model.py --samples 5000 --seed 7 --jobs 4
 
-# Label depression severity based on total_score
-def get_label(score):
-    if score <= 4:
-        return "None"
-    elif score <= 9:
-        return "Mild"
-    elif score <= 14:
-        return "Moderate"
-    elif score <= 19:
-        return "Moderately Severe"
-    else:
-        return "Severe"
+MODEL_PATH = "phq9_model.pkl"
+META_PATH = "phq9_model.json"
+ARTIFACT_FORMAT = 1
 
-df['label'] = df['total_score'].apply(get_label)
-df.drop(columns='total_score', inplace=True)
 
-print(df.head())
+def make_data(samples, seed):
+    # Labels come straight from the binned total score, no per-row apply()
+    rng = np.random.default_rng(seed)
+    X = rng.integers(0, NUM_OPTIONS, (samples, NUM_QUESTIONS), dtype=np.int8)
+    y = levels_for_scores(X.sum(axis=1))
+    return X, y
 
 
-X = df.drop('label', axis=1)
-y = df['label']
+def make_candidates(seed, jobs):
+    return {
+        "forest": RandomForestClassifier(n_estimators=100, n_jobs=jobs, random_state=seed),
+        "small_forest": RandomForestClassifier(n_estimators=25, max_depth=10, min_samples_leaf=2,
+                                               n_jobs=jobs, random_state=seed),
+        "tree": DecisionTreeClassifier(random_state=seed),
+        "threshold": ScoreThresholdModel(),
+    }
 
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
-model = RandomForestClassifier()
-model.fit(X_train, y_train)
+def all_answers():
+    shape = (NUM_OPTIONS,) * NUM_QUESTIONS
+    return np.array(np.unravel_index(np.arange(NUM_OPTIONS ** NUM_QUESTIONS), shape), dtype=np.int8).T
 
-y_pred = model.predict(X_test)
 
-print(classification_report(y_test, y_pred,zero_division=1))
+def evaluate(model, X_test, y_test, exhaustive_X, exhaustive_y):
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer, compress=3)
+    size = buffer.tell()
 
-import joblib
-joblib.dump(model, "phq9_model.pkl")
+    loads = []
+    for _ in range(5):
+        buffer.seek(0)
+        started = time.perf_counter()
+        joblib.load(buffer)
+        loads.append(time.perf_counter() - started)
+
+    row = X_test[:1]
+    predicts = []
+    for _ in range(50):
+        started = time.perf_counter()
+        model.predict(row)
+        predicts.append(time.perf_counter() - started)
+
+    return {
+        "test_accuracy": float(np.mean(model.predict(X_test) == y_test)),
+        # Every possible answer vector, against the exact scoring rule
+        "exhaustive_accuracy": float(np.mean(model.predict(exhaustive_X) == exhaustive_y)),
+        "artifact_bytes": size,
+        "load_ms": statistics.median(loads) * 1000,
+        "predict_ms": statistics.median(predicts) * 1000,
+    }
+
+
+def write_artifact(model, name, metrics, params, model_path=MODEL_PATH, meta_path=META_PATH):
+    version = 1
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            version = json.load(f).get("version", 0) + 1
+
+    joblib.dump(model, model_path, compress=3)
+    meta = {
+        "format": ARTIFACT_FORMAT,
+        "version": version,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "candidate": name,
+        "sha256": sha256_file(model_path),
+        "classes": [str(c) for c in model.classes_],
+        "questions": NUM_QUESTIONS,
+        "options": NUM_OPTIONS,
+        "sklearn": sklearn.__version__,
+        "params": params,
+        "metrics": metrics,
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the PHQ-9 severity model.")
+    parser.add_argument("--model", default="auto", choices=["auto", "forest", "small_forest", "tree", "threshold"],
+                        help="candidate to keep; auto keeps the most accurate, then the smallest")
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--jobs", type=int, default=-1, help="cores for forest training (-1: all)")
+    args = parser.parse_args()
+
+    X, y = make_data(args.samples, args.seed)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=args.test_size, random_state=args.seed)
+    exhaustive_X = all_answers()
+    exhaustive_y = levels_for_scores(exhaustive_X.sum(axis=1))
+
+    candidates = make_candidates(args.seed, args.jobs)
+    if args.model != "auto":
+        candidates = {args.model: candidates[args.model]}
+
+    results = {}
+    for name, model in candidates.items():
+        started = time.perf_counter()
+        model.fit(X_train, y_train)
+        results[name] = dict(evaluate(model, X_test, y_test, exhaustive_X, exhaustive_y),
+                             fit_ms=(time.perf_counter() - started) * 1000)
+
+    print(f"{'candidate':14} {'test acc':>9} {'all acc':>8} {'bytes':>10} {'load ms':>8} {'predict ms':>10} {'fit ms':>8}")
+    for name, r in results.items():
+        print(f"{name:14} {r['test_accuracy']:9.3f} {r['exhaustive_accuracy']:8.3f} {r['artifact_bytes']:10d} "
+              f"{r['load_ms']:8.2f} {r['predict_ms']:10.3f} {r['fit_ms']:8.1f}")
+
+    best = max(results, key=lambda name: (results[name]["exhaustive_accuracy"], -results[name]["artifact_bytes"]))
+    print()
+    print(classification_report(y_test, candidates[best].predict(X_test), zero_division=1))
+
+    params = {"samples": args.samples, "test_size": args.test_size, "seed": args.seed}
+    meta = write_artifact(candidates[best], best, results[best], params)
+    print(f"Saved {best} as {MODEL_PATH} v{meta['version']} (sha256 {meta['sha256'][:12]})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import hashlib
+import json
+
+import numpy as np
+
+import resources
+from metrics import timed
+
+# Lookup table built by build_phq9_table.py: one uint8 level code per
+# possible answer vector, indexed by the answers read as a base-4 number.
+TABLE_PATH = "phq9_table.npy"
+META_PATH = "phq9_table.json"
+NUM_QUESTIONS = 9
+NUM_OPTIONS = 4
+TABLE_FORMAT = 2
+
+# Standard PHQ-9 severity bands: a total score below 5 is None, below 10
+# Mild, and so on
+LEVELS = np.array(["None", "Mild", "Moderate", "Moderately Severe", "Severe"])
+LEVEL_BOUNDS = [5, 10, 15, 20]
+
+
+def levels_for_scores(scores):
+    return LEVELS[np.digitize(scores, LEVEL_BOUNDS)]
+
+
+class ScoreThresholdModel:
+    # The exact scoring rule behind the labels, with the predict/classes_
+    # interface of a fitted sklearn classifier
+    classes_ = np.array(sorted(LEVELS))
+
+    def fit(self, X, y=None):
+        return self
+
+    def predict(self, X):
+        return levels_for_scores(np.asarray(X).sum(axis=1))
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def answers_to_index(answers):
+    index = 0
+    for answer in answers:
+        index = index * NUM_OPTIONS + int(answer)
+    return index
+
+
+def load_table(table_path=TABLE_PATH, meta_path=META_PATH):
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get("format") != TABLE_FORMAT:
+        raise ValueError(f"{meta_path} has format {meta.get('format')}, expected {TABLE_FORMAT}; rerun build_phq9_table.py")
+    if meta["questions"] != NUM_QUESTIONS or meta["options"] != NUM_OPTIONS:
+        raise ValueError(f"{meta_path} describes a different questionnaire shape")
+    if sha256_file(table_path) != meta["sha256"]:
+        raise ValueError(f"{table_path} does not match the checksum in {meta_path}")
+
+    table = np.load(table_path, mmap_mode="r")
+    if table.shape != (NUM_OPTIONS ** NUM_QUESTIONS,):
+        raise ValueError(f"{table_path} has unexpected shape {table.shape}")
+    return table, meta["labels"]
+
+
+@timed("phq9.predict")
+def predict_level(answers):
+    # Loaded once per process and reloaded when build_phq9_table.py rewrites it
+    table, labels = resources.get("phq9_table")
+    return labels[table[answers_to_index(answers)]]
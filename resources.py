@@ -0,0 +1,205 @@
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import deque
+
+import metrics
+
+# Process-wide registry for heavy objects (model table, Gemini client, DB
+# schema, CSS). Streamlit re-executes app4.py on every interaction, but this
+# module is only imported once per process, so anything built here survives
+# reruns. Resources are built lazily on first get() and rebuilt when one of
+# their watched files changes on disk.
+
+logger = logging.getLogger("mindmate")
+
+_factories = {}
+_instances = {}
+_build_locks = {}
+_registry_lock = threading.Lock()
+
+_process_start = time.perf_counter()
+_startup_seconds = None
+_build_seconds = {}
+_rerun_seconds = deque(maxlen=500)
+_rerun_count = 0
+RERUN_REPORT_EVERY = 100
+
+
+def register(name, factory, watch=()):
+    # Re-registering keeps an already built instance
+    _factories[name] = (factory, tuple(watch))
+
+
+def _build_lock(name):
+    # One lock per resource: factories may get() the resources they depend
+    # on, and a slow build shouldn't hold up unrelated ones
+    with _registry_lock:
+        lock = _build_locks.get(name)
+        if lock is None:
+            lock = _build_locks[name] = threading.Lock()
+        return lock
+
+
+def _stamp(paths):
+    stamp = []
+    for path in paths:
+        try:
+            info = os.stat(path)
+            stamp.append((info.st_mtime_ns, info.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def get(name):
+    factory, watch = _factories[name]
+    stamp = _stamp(watch)
+    entry = _instances.get(name)
+    if entry is not None and entry[0] == stamp:
+        return entry[1]
+
+    with _build_lock(name):
+        entry = _instances.get(name)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        if entry is not None:
+            logger.info("Rebuilding %s: watched files changed", name)
+
+        started = time.perf_counter()
+        value = factory()
+        elapsed = time.perf_counter() - started
+
+        _build_seconds[name] = elapsed
+        _instances[name] = (stamp, value)
+        logger.info("Built %s in %.1f ms", name, elapsed * 1000)
+        return value
+
+
+def invalidate(name=None):
+    with _registry_lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
+
+
+# ------------------- TIMINGS -------------------
+def record_rerun(seconds):
+    global _startup_seconds, _rerun_count
+    if _startup_seconds is None:
+        _startup_seconds = time.perf_counter() - _process_start
+        logger.info("First run finished %.1f ms after startup", _startup_seconds * 1000)
+
+    _rerun_seconds.append(seconds)
+    metrics.observe("app.rerun", seconds)
+    _rerun_count += 1
+    if _rerun_count % RERUN_REPORT_EVERY == 0:
+        report = timing_report()
+        logger.info(
+            "Reruns: %d, p50 %.1f ms, max %.1f ms",
+            report["reruns"], report["rerun_p50_ms"], report["rerun_max_ms"],
+        )
+
+
+def timing_report():
+    reruns = list(_rerun_seconds)
+    return {
+        "startup_ms": None if _startup_seconds is None else _startup_seconds * 1000,
+        "build_ms": {name: seconds * 1000 for name, seconds in _build_seconds.items()},
+        "reruns": _rerun_count,
+        "rerun_p50_ms": statistics.median(reruns) * 1000 if reruns else 0.0,
+        "rerun_max_ms": max(reruns) * 1000 if reruns else 0.0,
+    }
+
+
+# ------------------- APP RESOURCES -------------------
+GEMINI_MODEL_NAME = "gemini-2.5-flash"
+CSS_PATH = "style.css"
+
+
+def _build_gen_model():
+    if os.environ.get("MINDMATE_FAKE_GEMINI") == "1":
+        from fake_gemini import FakeGenerativeModel
+
+        return FakeGenerativeModel(GEMINI_MODEL_NAME, latency=0.3, chunk_delay=0.05)
+
+    # Deferred so google.generativeai is only imported once a tab needs it
+    import google.generativeai as genai
+    import streamlit as st
+
+    genai.configure(api_key=st.secrets["api_keys"]["gemini"])
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+
+def _build_gemini():
+    from gemini_client import GeminiClient
+    from shared_cache import cache_from_env
+
+    return GeminiClient(get("gen_model"), cache=cache_from_env(), model_name=GEMINI_MODEL_NAME)
+
+
+def _build_suggestions():
+    from suggestions import SuggestionCache
+
+    # Pool slots are shared across workers; each slot is a separate draw
+    cache = SuggestionCache(lambda prompt, variant: get("gemini").generate_content(prompt, shared=variant).text)
+    cache.warm()
+    return cache
+
+
+def _build_schema():
+    from database import create_usertable
+
+    create_usertable()
+    return True
+
+
+def _build_sessions():
+    from auth import SessionStore, session_secret
+    from database import user_exists
+
+    return SessionStore(session_secret(), user_exists)
+
+
+def _build_session_memory():
+    from chat import ChatContext
+    from session_store import identity_codec, manager_from_env
+
+    return manager_from_env({
+        "chat_context": (ChatContext.dump, lambda data: ChatContext.load(get("gemini"), data)),
+        "history_rows": identity_codec(),
+        "history_cursor": identity_codec(),
+        "suggested_tasks": identity_codec(),
+    })
+
+
+def _build_phq9_table():
+    from phq9 import META_PATH, TABLE_PATH, load_table
+
+    if not (os.path.exists(TABLE_PATH) and os.path.exists(META_PATH)):
+        # The table is committed, but build it from the model if it was removed
+        import build_phq9_table
+
+        logger.warning("%s is missing; building it from %s", TABLE_PATH, build_phq9_table.MODEL_PATH)
+        build_phq9_table.write_table(*build_phq9_table.load_model())
+    elif os.path.exists("phq9_model.pkl") and os.path.getmtime("phq9_model.pkl") > os.path.getmtime(TABLE_PATH):
+        logger.warning("phq9_model.pkl is newer than %s; rerun build_phq9_table.py", TABLE_PATH)
+    return load_table()
+
+
+def _build_css():
+    with open(CSS_PATH, encoding="utf-8") as f:
+        return f"<style>\n{f.read()}\n</style>"
+
+
+register("gen_model", _build_gen_model)
+register("gemini", _build_gemini)
+register("suggestions", _build_suggestions)
+register("phq9_table", _build_phq9_table, watch=("phq9_table.npy", "phq9_table.json"))
+register("schema", _build_schema)
+register("sessions", _build_sessions)
+register("session_memory", _build_session_memory)
+register("css", _build_css, watch=(CSS_PATH,))
@@ -0,0 +1,42 @@
+import threading
+
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+from metrics import timed
+
+# One analyzer per process. Building it parses the VADER lexicon and emoji
+# tables, so it's done once; polarity_scores only reads them afterwards and
+# is safe to call from any session thread.
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+
+def get_analyzer():
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                _analyzer = SentimentIntensityAnalyzer()
+    return _analyzer
+
+
+def label_for(compound):
+    if compound >= 0.05:
+        return "Positive"
+    elif compound <= -0.05:
+        return "Negative"
+    else:
+        return "Neutral"
+
+
+@timed("sentiment.detect")
+def detect_sentiment(text):
+    score = get_analyzer().polarity_scores(text)
+    return label_for(score["compound"])
+
+
+# Label many texts with the shared analyzer, e.g. when backfilling mood_logs
+@timed("sentiment.detect_batch")
+def detect_sentiment_batch(texts):
+    polarity_scores = get_analyzer().polarity_scores
+    return [label_for(polarity_scores(text)["compound"]) for text in texts]
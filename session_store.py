@@ -0,0 +1,275 @@
+import atexit
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger("mindmate")
+
+# Per-session memory manager. The heavy parts of a logged-in session (the
+# chat context with its live chat session, loaded history pages, pinned
+# suggestions) live here rather than in st.session_state, keyed by a random
+# per-session key. Each value is stored under a slot name whose codec turns
+# it into plain JSON and back. The manager estimates every session's
+# footprint from that JSON form. Once the total passes the budget, the
+# least recently used sessions idle for at least min_idle seconds are
+# written zlib-compressed to an SQLite file and dropped from memory. A
+# spilled session is restored on its next access.
+#
+# MINDMATE_SESSION_MEMORY_MB sets the budget (default 256).
+SESSION_MEMORY_BUDGET = 256 * 1024 * 1024
+# Longer than a streamed chat reply can take, so a session is never spilled mid-use
+SESSION_MIN_IDLE = 300
+# Browsers that never come back leave sessions behind, live or spilled; drop them after a day
+SPILL_EXPIRE_AFTER = 24 * 3600
+# How often enforce() looks for expired sessions
+EXPIRE_CHECK_INTERVAL = 60
+SPILL_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS spilled(key TEXT PRIMARY KEY, data BLOB NOT NULL, '
+    'bytes INTEGER NOT NULL, used REAL NOT NULL) WITHOUT ROWID'
+)
+
+
+_MISSING = object()
+
+
+def identity_codec():
+    return (lambda value: value), (lambda data: data)
+
+
+def deep_size(value):
+    # Approximate bytes held by a JSON-like structure
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(k) + deep_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_size(item) for item in value)
+    return size
+
+
+class _Session:
+    __slots__ = ("values", "bytes", "used", "dirty")
+
+    def __init__(self, values=None):
+        self.values = values or {}
+        self.bytes = 0
+        self.used = time.monotonic()
+        self.dirty = True
+
+
+class SessionMemoryManager:
+    def __init__(self, codecs, budget=SESSION_MEMORY_BUDGET, min_idle=SESSION_MIN_IDLE,
+                 expire_after=SPILL_EXPIRE_AFTER, path=None):
+        # codecs: {slot: (dump, load)}; dump(value) must give JSON-serializable data
+        self.codecs = codecs
+        self.budget = budget
+        self.min_idle = min_idle
+        self.expire_after = expire_after
+        self._dir = None
+        if path is None:
+            # Sessions belong to this process, so the spill file does too. It
+            # goes in a fresh private directory (mode 0700): other local users
+            # can't read it, and a file left by a killed process is never
+            # picked up by a new one that happens to get the same pid.
+            self._dir = tempfile.mkdtemp(prefix="mindmate-sessions-")
+            path = os.path.join(self._dir, "sessions.db")
+            atexit.register(self._remove_file)
+        self.path = path
+        self._sessions = OrderedDict()   # key -> _Session, least recently used first
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        with self._conn:
+            self._conn.execute(SPILL_SCHEMA)
+        self.spills = 0
+        self.restores = 0
+        self.expired = 0
+        self._expire_checked = time.monotonic()
+
+    def _remove_file(self):
+        self._conn.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    # ------------------- ACCESS -------------------
+    def _session(self, key, create=True):
+        # Caller holds the lock
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._restore(key)
+            if session is None:
+                if not create:
+                    return None
+                session = _Session()
+            self._sessions[key] = session
+        self._sessions.move_to_end(key)
+        session.used = time.monotonic()
+        # Values can be changed in place (ChatContext.record), so re-measure later
+        session.dirty = True
+        return session
+
+    def get(self, key, slot, default=None):
+        with self._lock:
+            session = self._session(key, create=False)
+            return default if session is None else session.values.get(slot, default)
+
+    def set(self, key, slot, value):
+        if slot not in self.codecs:
+            raise KeyError(f"No codec for session slot {slot!r}")
+        with self._lock:
+            self._session(key).values[slot] = value
+
+    def pop(self, key, slot, default=None):
+        with self._lock:
+            session = self._session(key, create=False)
+            return default if session is None else session.values.pop(slot, default)
+
+    def drop(self, key):
+        # Logout: forget the session in memory and on disk
+        with self._lock:
+            self._sessions.pop(key, None)
+            with self._conn:
+                self._conn.execute('DELETE FROM spilled WHERE key = ?', (key,))
+
+    def slots(self, key):
+        return SessionSlots(self, key)
+
+    # ------------------- SPILL / RESTORE -------------------
+    def _dump(self, session):
+        return {slot: self.codecs[slot][0](value) for slot, value in session.values.items()}
+
+    def _measure(self, session):
+        if session.dirty:
+            session.bytes = deep_size(self._dump(session))
+            session.dirty = False
+        return session.bytes
+
+    def _spill(self, key, session):
+        data = zlib.compress(json.dumps(self._dump(session), ensure_ascii=False).encode("utf-8"), 6)
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO spilled(key, data, bytes, used) VALUES (?, ?, ?, ?)',
+                (key, data, session.bytes, time.time() - (time.monotonic() - session.used)),
+            )
+        del self._sessions[key]
+        self.spills += 1
+        metrics.incr("session_memory.spills")
+
+    def _restore(self, key):
+        row = self._conn.execute('SELECT data FROM spilled WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        with self._conn:
+            self._conn.execute('DELETE FROM spilled WHERE key = ?', (key,))
+        data = json.loads(zlib.decompress(row[0]).decode("utf-8"))
+        self.restores += 1
+        metrics.incr("session_memory.restores")
+        with metrics.span("session_memory.restore"):
+            return _Session({slot: self.codecs[slot][1](value) for slot, value in data.items() if slot in self.codecs})
+
+    def _expire(self, now):
+        # Caller holds the lock. Live sessions are in least recently used order.
+        expired = 0
+        for key, session in list(self._sessions.items()):
+            if now - session.used < self.expire_after:
+                break
+            del self._sessions[key]
+            expired += 1
+        with self._conn:
+            expired += self._conn.execute(
+                'DELETE FROM spilled WHERE used < ?', (time.time() - self.expire_after,)
+            ).rowcount
+        if expired:
+            self.expired += expired
+            metrics.incr("session_memory.expired", expired)
+            logger.info("Dropped %d sessions idle for over %ds", expired, self.expire_after)
+
+    def enforce(self):
+        # Call once per rerun: spills idle sessions, oldest first, until the
+        # live total fits the budget; returns the number spilled. Sessions
+        # idle longer than expire_after are dropped, checked at most every
+        # EXPIRE_CHECK_INTERVAL seconds.
+        with self._lock:
+            now = time.monotonic()
+            if now - self._expire_checked >= EXPIRE_CHECK_INTERVAL:
+                self._expire_checked = now
+                self._expire(now)
+            total = sum(self._measure(session) for session in self._sessions.values())
+            spilled = 0
+            for key, session in list(self._sessions.items()):
+                if total <= self.budget or now - session.used < self.min_idle:
+                    break
+                total -= session.bytes
+                self._spill(key, session)
+                spilled += 1
+            if total > self.budget:
+                metrics.incr("session_memory.over_budget")
+        if spilled:
+            logger.info("Spilled %d idle sessions to disk; %.1f MB live", spilled, total / 1e6)
+        return spilled
+
+    # ------------------- REPORT -------------------
+    def report(self):
+        with self._lock:
+            now = time.monotonic()
+            sessions = {
+                key: {"state": "live", "bytes": self._measure(session), "idle_seconds": now - session.used}
+                for key, session in self._sessions.items()
+            }
+            for key, raw, size, used in self._conn.execute('SELECT key, length(data), bytes, used FROM spilled'):
+                sessions[key] = {"state": "spilled", "bytes": size, "disk_bytes": raw,
+                                     "idle_seconds": time.time() - used}
+        live = [s for s in sessions.values() if s["state"] == "live"]
+        spilled = [s for s in sessions.values() if s["state"] == "spilled"]
+        return {
+            "budget_bytes": self.budget,
+            "live_sessions": len(live),
+            "live_bytes": sum(s["bytes"] for s in live),
+            "spilled_sessions": len(spilled),
+            "spilled_bytes": sum(s["bytes"] for s in spilled),
+            "spilled_disk_bytes": sum(s["disk_bytes"] for s in spilled),
+            "spills": self.spills,
+            "restores": self.restores,
+            "expired": self.expired,
+            "sessions": sessions,
+        }
+
+
+class SessionSlots:
+    # Dict-like view of one session's slots, for use in place of st.session_state
+    def __init__(self, manager, key):
+        self.manager = manager
+        self.key = key
+
+    def __contains__(self, slot):
+        return self.manager.get(self.key, slot, _MISSING) is not _MISSING
+
+    def __getitem__(self, slot):
+        value = self.manager.get(self.key, slot, _MISSING)
+        if value is _MISSING:
+            raise KeyError(slot)
+        return value
+
+    def __setitem__(self, slot, value):
+        self.manager.set(self.key, slot, value)
+
+    def get(self, slot, default=None):
+        return self.manager.get(self.key, slot, default)
+
+    def pop(self, slot, default=None):
+        return self.manager.pop(self.key, slot, default)
+
+
+def manager_from_env(codecs):
+    megabytes = os.environ.get("MINDMATE_SESSION_MEMORY_MB")
+    budget = float(megabytes) * 1024 * 1024 if megabytes else SESSION_MEMORY_BUDGET
+    return SessionMemoryManager(codecs, budget=budget)
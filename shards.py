@@ -0,0 +1,180 @@
+import argparse
+import os
+import pathlib
+import sqlite3
+import time
+
+from database import (
+    _connect, archive_path, create_archive_schema, create_tables, create_usertable, for_each_shard, get_conn,
+    shard_for, shard_paths,
+)
+from metrics import timed
+
+# Admin tools for sharded storage (MINDMATE_SHARDS, see database.py). Each
+# shard is a complete MindMate database holding the users that hash to it.
+#
+#   python shards.py where alice                   which shard holds a user
+#   python shards.py stats                         users, rows and size per shard
+#   python shards.py query "SELECT COUNT(*) FROM chat_history"
+#   python shards.py rebalance --drain users.db    move users to the shard they hash to
+#
+# Rebalance after changing the shard list, with the app stopped; --drain
+# names old files (e.g. the single users.db) whose users should all move out.
+
+# Copied in full for every moving user; the FTS indexes follow through their triggers
+USER_TABLES = ('userstable', 'mood_logs', 'phq9_results', 'chat_history', 'mood_daily', 'phq9_daily')
+ARCHIVE_TABLES = ('chat_history', 'mood_logs')
+COUNTED_TABLES = ('userstable', 'mood_logs', 'phq9_results', 'chat_history')
+
+
+# ------------------- CROSS-SHARD QUERIES -------------------
+def _query_read_only(path, sql, params):
+    # A private connection opened with mode=ro, so the query can't write
+    conn = sqlite3.connect(pathlib.Path(path).resolve().as_uri() + '?mode=ro', uri=True)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def query_all(sql, params=()):
+    # Runs a read-only query on every shard in parallel; returns {shard: rows}
+    return for_each_shard(lambda path: _query_read_only(path, sql, params))
+
+
+def _shard_stats(path):
+    conn = get_conn(path=path)
+    stats = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in COUNTED_TABLES}
+    stats['bytes'] = sum(os.path.getsize(file) for file in (path, path + '-wal', archive_path(path)) if os.path.exists(file))
+    return stats
+
+
+@timed('shards.stats')
+def shard_stats():
+    create_usertable()
+    return for_each_shard(_shard_stats)
+
+
+# ------------------- REBALANCE -------------------
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})')]
+
+
+def _usernames(conn, archived):
+    names = set()
+    for schema, tables in (('main', COUNTED_TABLES), ('archive', ARCHIVE_TABLES if archived else ())):
+        for table in tables:
+            names.update(row[0] for row in conn.execute(f'SELECT DISTINCT username FROM {schema}.{table}'))
+    names.discard(None)
+    return names
+
+
+def _move(conn, dest, usernames, archived):
+    # conn is a private connection to the source shard. The destination is
+    # written and committed first, then the source rows are deleted, so a
+    # crash in between leaves the users in both files and a rerun redoes the
+    # copy (the destination side is cleared first) rather than losing them.
+    # Archived rows are keyed by their old main rowid, which means nothing in
+    # the destination, so they get fresh ids there: negative, below any it
+    # already has, in their original order. Main rowids are never negative,
+    # so the two can't collide.
+    conn.execute('ATTACH DATABASE ? AS dest', (dest,))
+    moves = [('main', 'dest', USER_TABLES)]
+    if archived:
+        conn.execute('ATTACH DATABASE ? AS dest_archive', (archive_path(dest),))
+        create_archive_schema(conn, 'dest_archive')
+        moves.append(('archive', 'dest_archive', ARCHIVE_TABLES))
+    try:
+        with conn:
+            conn.execute('DELETE FROM temp.moving')
+            conn.executemany('INSERT INTO temp.moving VALUES (?)', [(name,) for name in usernames])
+            for source, target, tables in moves:
+                for table in tables:
+                    columns = _columns(conn, source, table)
+                    conn.execute(f'DELETE FROM {target}.{table} WHERE username IN (SELECT username FROM temp.moving)')
+                    values = columns
+                    if source == 'archive':
+                        below = min(conn.execute(f'SELECT IFNULL(MIN(id), 0) FROM {target}.{table}').fetchone()[0], 0)
+                        values = [f'{below} - ROW_NUMBER() OVER (ORDER BY id DESC)' if column == 'id' else column
+                                  for column in columns]
+                    conn.execute(
+                        f'INSERT INTO {target}.{table}({", ".join(columns)}) SELECT {", ".join(values)} '
+                        f'FROM {source}.{table} WHERE username IN (SELECT username FROM temp.moving)'
+                    )
+        with conn:
+            for source, _, tables in moves:
+                for table in tables:
+                    conn.execute(f'DELETE FROM {source}.{table} WHERE username IN (SELECT username FROM temp.moving)')
+    finally:
+        conn.execute('DETACH DATABASE dest')
+        if archived:
+            conn.execute('DETACH DATABASE dest_archive')
+
+
+@timed('shards.rebalance')
+def rebalance(drain=(), dry_run=False):
+    # Moves every user whose rows sit outside the shard they hash to;
+    # returns {(source, dest): users moved}
+    create_usertable()
+    moved = {}
+    for source in shard_paths() + [path for path in drain if path not in shard_paths()]:
+        create_tables(source)
+        conn = _connect(source)
+        try:
+            archived = os.path.exists(archive_path(source))
+            if archived:
+                conn.execute('ATTACH DATABASE ? AS archive', (archive_path(source),))
+            plan = {}
+            for username in _usernames(conn, archived):
+                dest = shard_for(username)
+                if dest != source:
+                    plan.setdefault(dest, []).append(username)
+            conn.execute('CREATE TEMP TABLE moving(username TEXT PRIMARY KEY)')
+            for dest, usernames in plan.items():
+                if not dry_run:
+                    _move(conn, dest, usernames, archived)
+                moved[(source, dest)] = len(usernames)
+        finally:
+            conn.close()
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and rebalance the MindMate database shards.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    where = sub.add_parser('where', help="print the shard a user's rows belong in")
+    where.add_argument('username')
+    sub.add_parser('stats', help='users, rows and bytes per shard')
+    query = sub.add_parser('query', help='run a read-only SQL query on every shard')
+    query.add_argument('sql')
+    move = sub.add_parser('rebalance', help='move users to the shard they hash to')
+    move.add_argument('--drain', action='append', default=[], help='old database file to empty; repeatable')
+    move.add_argument('--dry-run', action='store_true', help='only print how many users would move')
+    args = parser.parse_args()
+    if args.command == 'rebalance':
+        for path in args.drain:
+            if not os.path.exists(path):
+                parser.error(f'no such database: {path}')
+
+    if args.command == 'where':
+        print(shard_for(args.username))
+    elif args.command == 'stats':
+        stats = shard_stats()
+        print(f"{'shard':40} {'users':>9} {'moods':>10} {'phq9':>10} {'chats':>10} {'MB':>9}")
+        for path, row in stats.items():
+            print(f"{path:40} {row['userstable']:9} {row['mood_logs']:10} {row['phq9_results']:10} "
+                  f"{row['chat_history']:10} {row['bytes'] / 1e6:9.1f}")
+    elif args.command == 'query':
+        for path, rows in query_all(args.sql).items():
+            for row in rows:
+                print(path, *row, sep='\t')
+    else:
+        started = time.perf_counter()
+        moved = rebalance(args.drain, args.dry_run)
+        for (source, dest), count in moved.items():
+            print(f"{source} -> {dest}: {count} users{' (dry run)' if args.dry_run else ''}")
+        print(f"{sum(moved.values())} users in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+
+import metrics
+
+logger = logging.getLogger("mindmate")
+
+# Key/value cache in a local SQLite file, shared by every worker process on
+# the host and kept across restarts. GeminiClient puts it under the
+# generate_content calls that opt in (the suggestion pools, see
+# suggestions.py), keyed by model name plus the normalized prompt and a tag.
+# Nothing private to a user is stored here.
+#
+#   - entries expire after their TTL; past max_entries the least recently
+#     used are evicted (last use is recorded at most every ACCESS_RESOLUTION
+#     seconds, so hits stay read-only),
+#   - stampede protection: on a miss one process takes a lease on the key
+#     and calls the model; the others poll for its result instead of making
+#     the same call, and compute it themselves only if the lease (or the
+#     caller's wait) runs out,
+#   - hit/miss counts per process, flushed to the file every
+#     STATS_FLUSH_INTERVAL seconds for a host-wide hit rate.
+#
+# MINDMATE_GEMINI_CACHE sets the file; an empty value turns the cache off.
+CACHE_PATH = "gemini-cache.db"
+CACHE_TTL = 3600
+CACHE_MAX_ENTRIES = 10000
+ACCESS_RESOLUTION = 60
+EVICT_EVERY = 100
+LEASE_TTL = 20.0
+LEASE_POLL = 0.05
+STATS_FLUSH_INTERVAL = 10.0
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache(key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+    'expires REAL NOT NULL, accessed REAL NOT NULL) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache(accessed)',
+    'CREATE TABLE IF NOT EXISTS leases(key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS stats(name TEXT PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID',
+)
+COUNTERS = ('hits', 'misses', 'computed', 'waited', 'lease_timeouts', 'evicted')
+
+
+def normalize(prompt):
+    # Case and spacing don't change what the model is asked
+    return " ".join(prompt.split()).casefold()
+
+
+def cache_key(model_name, prompt):
+    return hashlib.sha256(f"{model_name}\0{normalize(prompt)}".encode("utf-8")).hexdigest()
+
+
+class SharedCache:
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES,
+                 lease_ttl=LEASE_TTL, poll=LEASE_POLL):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lease_ttl = lease_ttl
+        self.poll = poll
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._unflushed = Counter()
+        self._flushed_at = time.monotonic()
+        self._puts = 0
+        with self._conn() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _count(self, name, amount=1):
+        metrics.incr(f"cache.{name}", amount)
+        with self._lock:
+            self._counts[name] += amount
+            self._unflushed[name] += amount
+            if time.monotonic() - self._flushed_at < STATS_FLUSH_INTERVAL:
+                return
+            pending, self._unflushed = self._unflushed, Counter()
+            self._flushed_at = time.monotonic()
+        try:
+            with self._conn() as conn:
+                conn.executemany(
+                    'INSERT INTO stats(name, count) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET count = count + excluded.count',
+                    pending.items(),
+                )
+        except sqlite3.Error as e:
+            logger.debug("Cache stats flush failed: %s", e)
+
+    # ------------------- GET / PUT -------------------
+    def _read(self, key):
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute('SELECT value, accessed FROM cache WHERE key = ? AND expires > ?', (key, now)).fetchone()
+            if row is not None and now - row[1] > ACCESS_RESOLUTION:
+                with conn:
+                    conn.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        except sqlite3.Error as e:
+            # The cache is an optimization; a locked or broken file is a miss
+            logger.warning("Shared cache read failed: %s", e)
+            return None
+        return row[0] if row is not None else None
+
+    def get(self, key):
+        value = self._read(key)
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def put(self, key, value, ttl=None):
+        now = time.time()
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO cache(key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                    (key, value, now + (ttl or self.ttl), now),
+                )
+            with self._lock:
+                self._puts += 1
+                evict = self._puts % EVICT_EVERY == 0
+            if evict:
+                self.evict()
+        except sqlite3.Error as e:
+            logger.warning("Shared cache write failed: %s", e)
+
+    def evict(self):
+        # Expired entries first, then the least recently used over max_entries
+        with self._conn() as conn:
+            removed = conn.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),)).rowcount
+            excess = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.max_entries
+            if excess > 0:
+                removed += conn.execute(
+                    'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)', (excess,)
+                ).rowcount
+        if removed:
+            self._count("evicted", removed)
+        return removed
+
+    # ------------------- STAMPEDE PROTECTION -------------------
+    def _acquire(self, key, owner):
+        now = time.time()
+        with self._conn() as conn:
+            return conn.execute(
+                'INSERT INTO leases(key, owner, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires = excluded.expires '
+                'WHERE leases.expires <= ?',
+                (key, owner, now + self.lease_ttl, now),
+            ).rowcount == 1
+
+    def _release(self, key, owner):
+        try:
+            with self._conn() as conn:
+                conn.execute('DELETE FROM leases WHERE key = ? AND owner = ?', (key, owner))
+        except sqlite3.Error as e:
+            logger.warning("Shared cache lease release failed: %s", e)
+
+    def get_or_compute(self, key, compute, ttl=None, wait=None, admit=None):
+        # compute() must return a str. Its exceptions propagate, and nothing
+        # is cached for them. On a miss admit() runs before any lease or wait
+        # and may raise to give up early; wait caps how long to poll for
+        # another process's result (default lease_ttl).
+        value = self.get(key)
+        if value is not None:
+            return value
+        if admit is not None:
+            admit()
+
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        deadline = time.monotonic() + min(self.lease_ttl, wait if wait is not None else self.lease_ttl)
+        while True:
+            try:
+                leader = self._acquire(key, owner)
+            except sqlite3.Error as e:
+                logger.warning("Shared cache lease failed: %s", e)
+                leader, owner = True, None
+            if leader:
+                # The previous leader may have finished just before we got in
+                value = self._read(key)
+                if value is not None:
+                    self._release(key, owner)
+                    return value
+                break
+            if time.monotonic() >= deadline:
+                self._count("lease_timeouts")
+                break
+            # Another process is computing this key; wait for its result
+            time.sleep(self.poll)
+            value = self._read(key)
+            if value is not None:
+                self._count("waited")
+                return value
+
+        try:
+            value = compute()
+            self._count("computed")
+            self.put(key, value, ttl)
+            return value
+        finally:
+            if owner is not None:
+                self._release(key, owner)
+
+    # ------------------- STATS -------------------
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            pending = Counter(self._unflushed)
+        lookups = counts.get("hits", 0) + counts.get("misses", 0)
+        report = {name: counts.get(name, 0) for name in COUNTERS}
+        report["hit_rate"] = counts.get("hits", 0) / lookups if lookups else 0.0
+        try:
+            conn = self._conn()
+            shared = Counter(dict(conn.execute('SELECT name, count FROM stats').fetchall())) + pending
+            report["entries"] = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        except sqlite3.Error:
+            return report
+        shared_lookups = shared["hits"] + shared["misses"]
+        report["shared"] = {name: shared[name] for name in COUNTERS}
+        report["shared"]["hit_rate"] = shared["hits"] / shared_lookups if shared_lookups else 0.0
+        return report
+
+
+def cache_from_env():
+    path = os.environ.get("MINDMATE_GEMINI_CACHE", CACHE_PATH)
+    return SharedCache(path) if path else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the shared Gemini cache.")
+    parser.add_argument('command', choices=['stats', 'evict'])
+    parser.add_argument('--path', default=os.environ.get("MINDMATE_GEMINI_CACHE") or CACHE_PATH)
+    args = parser.parse_args()
+
+    cache = SharedCache(args.path)
+    if args.command == 'evict':
+        print(f"Evicted {cache.evict()} entries")
+    else:
+        print(json.dumps(cache.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("mindmate")
+
+PROMPTS = {
+    "Positive": "Generate 5 very short and fun tasks to do for someone who is feeling great.",
+    "Neutral": "Generate 5 simple and calming tasks for someone with a neutral mood.",
+    "Negative": "Generate 5 short and helpful tasks for someone who is feeling low. The tasks should be easy to do.",
+}
+DEFAULT_PROMPT = "Generate 5 helpful tasks."
+
+fallback_tasks = {
+    "Positive": [
+        "Write down three things you are grateful for right now. 🙏",
+        "Listen to your favorite upbeat song and dance like nobody's watching! 💃",
+        "Plan a fun activity for the weekend to look forward to. 🗓️",
+        "Send a message of appreciation to someone who has helped you. 💌",
+        "Take a short walk and notice five beautiful things around you. 🌳",
+    ],
+    "Neutral": [
+        "Take a moment to simply breathe deeply. 🧘",
+        "Straighten up your desk or living space. 🧹",
+        "Write a simple to-do list for tomorrow. 📝",
+        "Put your phone away for 15 minutes. 📵",
+        "Drink a full glass of water. 💧",
+    ],
+    "Negative": [
+        "Acknowledge how you're feeling without judgment. It's okay. 🫂",
+        "Watch a short video of something that always makes you laugh. 😂",
+        "Call or text a friend you trust. 📞",
+        "Take a warm shower or bath to reset. 🛀",
+        "Listen to music that validates your emotions. 🎶",
+    ],
+}
+
+
+def parse_tasks(text):
+    return [t.strip() for t in text.split('\n') if t.strip()]
+
+
+def pick_fallback(sentiment, count=3):
+    tasks = fallback_tasks.get(sentiment, [])
+    return random.sample(tasks, min(count, len(tasks)))
+
+
+class SuggestionCache:
+    # Per sentiment, a rotating pool of up to pool_size generated task lists.
+    # Lists expire after ttl seconds; the pool is topped up in the background
+    # whenever it is short or its oldest list is older than refresh_after.
+    # A miss never waits on the model: it returns fallback tasks right away.
+    # generate(prompt, variant) gets the pool slot and refresh period as
+    # variant, so workers sharing a cache fill their pools with the same lists.
+
+    def __init__(self, generate, ttl=3600, refresh_after=1800, pool_size=5, max_workers=2):
+        self.generate = generate
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.pool_size = pool_size
+        self._pools = {}
+        self._turns = {}
+        self._slots = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="mindmate-suggest")
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def get(self, sentiment):
+        # Returns (tasks, fresh); fresh is False when tasks are fallbacks
+        now = time.monotonic()
+        with self._lock:
+            # Oldest list first, so expiry and eviction work from the front
+            pool = self._pools.setdefault(sentiment, [])
+            while pool and now - pool[0][0] > self.ttl:
+                pool.pop(0)
+
+            if pool:
+                self.hits += 1
+                turn = self._turns.get(sentiment, 0)
+                self._turns[sentiment] = turn + 1
+                tasks = pool[turn % len(pool)][1]
+                if len(pool) < self.pool_size or now - pool[0][0] > self.refresh_after:
+                    self._schedule(sentiment)
+                return tasks, True
+
+            self.misses += 1
+            self._schedule(sentiment)
+        return pick_fallback(sentiment), False
+
+    def warm(self, sentiments=tuple(PROMPTS)):
+        with self._lock:
+            for sentiment in sentiments:
+                self._schedule(sentiment)
+
+    def _schedule(self, sentiment):
+        # Caller holds the lock; at most one refresh per sentiment in flight
+        if sentiment not in self._refreshing:
+            self._refreshing.add(sentiment)
+            self._executor.submit(self._refresh, sentiment)
+
+    def _refresh(self, sentiment):
+        with self._lock:
+            slot = self._slots.get(sentiment, 0)
+            self._slots[sentiment] = (slot + 1) % self.pool_size
+        variant = f"{slot}@{int(time.time() // self.refresh_after)}"
+        try:
+            tasks = parse_tasks(self.generate(PROMPTS.get(sentiment, DEFAULT_PROMPT), variant))
+        except Exception as e:
+            logger.warning("Suggestion refresh for %s failed: %s", sentiment, e)
+            with self._lock:
+                self.refresh_errors += 1
+                self._refreshing.discard(sentiment)
+            return
+
+        with self._lock:
+            self._refreshing.discard(sentiment)
+            self.refreshes += 1
+            if tasks:
+                pool = self._pools.setdefault(sentiment, [])
+                # A slot drawn again in the same period comes back unchanged
+                pool[:] = [entry for entry in pool if entry[1] != tasks]
+                pool.append((time.monotonic(), tasks))
+                while len(pool) > self.pool_size:
+                    pool.pop(0)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "pooled": {sentiment: len(pool) for sentiment, pool in self._pools.items()},
+            }
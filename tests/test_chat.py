@@ -0,0 +1,15 @@
+import time
+
+from chat import ChatContext
+from fake_gemini import FakeGenerativeModel
+
+
+def test_dump_does_not_hide_a_finished_summary_from_the_chat():
+    context = ChatContext(FakeGenerativeModel(), [(f"message {n} " * 30, f"reply {n} " * 60) for n in range(40)])
+    while not context._summary.done():
+        time.sleep(0.01)
+
+    data = context.dump()
+    assert data["summary"] and data["pending"] == []
+    context.record("hi", "hello")
+    assert context.chat.history[0]["parts"][0].startswith("Summary of our earlier conversation")
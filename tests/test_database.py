@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "users.db")
+    database.configure_storage(database.SingleFileStorage(path))
+    database.create_usertable()
+    yield path
+    database.configure_storage(database.storage_from_env())
+
+
+def on_new_thread(fn):
+    result = []
+    t = threading.Thread(target=lambda: result.append(fn()))
+    t.start()
+    t.join()
+    return result[0]
+
+
+def test_a_new_thread_reuses_the_connection_a_finished_one_checked_in(db):
+    first = on_new_thread(lambda: (database.attach_archive(path=db, create=True), database.get_conn(path=db))[1])
+    # The next interaction's thread gets it back ready, archive still attached
+    assert on_new_thread(lambda: database.get_conn(path=db)) is first
+    assert first in database._archived
+    assert on_new_thread(lambda: database.get_chat_page("someone"))[0] == []
+
+    database.close_all()
+    assert on_new_thread(lambda: database.get_conn(path=db)) is not first
+
+
+def test_legacy_passwords_leave_the_file_as_salted_keys(tmp_path, monkeypatch):
+    import sqlite3
+
+    path = str(tmp_path / "legacy.db")
+    legacy = sqlite3.connect(path)
+    legacy.execute("CREATE TABLE userstable(username TEXT, password TEXT)")
+    legacy.executemany("INSERT INTO userstable VALUES (?, ?)",
+                       [(f"user{n}", f"hunter2-secret-{n}") for n in range(450)])
+    legacy.commit()
+    legacy.close()
+
+    monkeypatch.setattr(database, "LEGACY_HASH_BATCH", 100)
+    database.configure_storage(database.SingleFileStorage(path))
+    try:
+        database.create_usertable()
+        conn = database.get_conn(path=path)
+        assert conn.execute("SELECT DISTINCT iterations FROM userstable").fetchall() == [(database.MIGRATION_ITERATIONS,)]
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        assert b"hunter2-secret" not in open(path, "rb").read()
+
+        # The next login raises the cheap key to the full count
+        assert database.login_user("user7", "wrong") is None
+        assert database.login_user("user7", "hunter2-secret-7") == "user7"
+        assert conn.execute("SELECT iterations FROM userstable WHERE username = 'user7'").fetchone()[0] == \
+            database.PASSWORD_ITERATIONS
+    finally:
+        database.configure_storage(database.storage_from_env())
@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from fake_gemini import FakeGenerativeModel
+from gemini_client import GeminiClient, GeminiUnavailable
+
+
+def test_abandoned_stream_keeps_the_next_turn():
+    model = FakeGenerativeModel(chunk_delay=0.3)
+    client = GeminiClient(model, timeout=2.0, chunk_timeout=0.05)
+    chat = client.start_chat()
+
+    # The first chunk arrives, then the stream stalls past chunk_timeout
+    with pytest.raises(GeminiUnavailable):
+        for _ in chat.send_message("first", stream=True):
+            pass
+    chat.rewind()
+
+    # The stalled pump is still running: a second stream must not start on the session
+    with pytest.raises(GeminiUnavailable, match="still in progress"):
+        chat.send_message("second", stream=True)
+
+    # Once the pump has given up, it has rewound only its own turn
+    while not chat._call.finished:
+        time.sleep(0.05)
+    assert chat.history == []
+
+    model.chunk_delay = 0.0
+    reply = "".join(chunk.text for chunk in chat.send_message("second", stream=True))
+    assert reply.startswith("Thanks")
+    assert [turn["parts"][0] for turn in chat.history] == ["second", reply]
+
+
+def test_only_tagged_prompts_reach_the_shared_cache(tmp_path):
+    from chat import summarize
+    from shared_cache import SharedCache
+
+    cache = SharedCache(str(tmp_path / "cache.db"))
+    first = GeminiClient(FakeGenerativeModel(), cache=cache, model_name="fake")
+    second = GeminiClient(FakeGenerativeModel(), cache=cache, model_name="fake")
+
+    # Chat summaries hold a user's own words and never go in the shared file
+    summarize(first, "", [("I feel low", "I'm sorry to hear that.")])
+    assert cache.stats()["entries"] == 0
+
+    # A suggestion pool slot drawn by one worker is served to the others
+    tasks = first.generate_content("Generate 5 helpful tasks.", shared="0@1").text
+    assert second.generate_content("Generate 5 helpful tasks.", shared="0@1").text == tasks
+    assert second.model.calls == 0
+    assert cache.stats()["entries"] == 1
@@ -0,0 +1,16 @@
+import metrics
+
+
+def test_nested_profile_is_skipped_and_url_switch_needs_the_env_flag(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "PROFILE_DIR", str(tmp_path))
+    # A fragment run inside a profiled page must not start a second profiler
+    with metrics.maybe_profile("outer", force=True) as outer:
+        with metrics.maybe_profile("inner", force=True) as inner:
+            pass
+    assert outer is not None and inner is None
+    assert len(list(tmp_path.iterdir())) == 1
+
+    monkeypatch.delenv("MINDMATE_PROFILE_URL", raising=False)
+    assert not metrics.profile_url_allowed()
+    monkeypatch.setenv("MINDMATE_PROFILE_URL", "1")
+    assert metrics.profile_url_allowed()